@@ -0,0 +1,455 @@
+# ##########################################################################################
+# garmin_waypoint_benchmark
+# Hans Straßgütl
+#
+# Reproducible timings of the paths that get slow with many waypoints: loading the folder,
+# refreshing it, saving, writing GPX, placing markers and loading the icons. Synthetic GPX
+# corpora (same seed every time) are generated in a temporary folder, once with one file
+# per waypoint and once with all waypoints in one file. The map is replaced by a stand-in
+# that only counts markers, so no display is needed; the icon cache is timed only when
+# Tk can open a display (e.g. under Xvfb).
+#
+#   python garmin_waypoint_benchmark.py -o results.json
+#   python garmin_waypoint_benchmark.py --sizes 1,1000,10000,100000 --compare results.json
+#
+# The results are written as JSON (one entry per benchmark with the best and the median
+# time of all runs) and can be compared with the results of another version.
+#
+#   python garmin_waypoint_benchmark.py --import-budget
+#
+# checks that importing the program stays within IMPORT_BUDGET_MS and leaves the map,
+# requests and PIL for later (exit code 1 if not).
+# ..........................................................................................
+# More information: readme.md
+#
+# Changes:
+#   2026 10 17      Started.
+#                   Import time budget of the program.
+#                   Waypoint search.
+#                   Duplicate finder.
+#
+# ##########################################################################################
+# Version 1.5
+# ------------------------------------------------------------------------------------------
+# Global Imports
+# ------------------------------------------------------------------------------------------
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from garmin_waypoint_core import (GARMIN_ICONS, SymbolRegistry, Waypoint, WaypointStore, WaypointIndexCache,
+                                  WaypointLoader, GpxWriter,
+                                  GpxCollection, atomic_write_gpx, build_description, world_xy, find_duplicates)
+
+# ------------------------------------------------------------------------------------------
+# Settings
+# ------------------------------------------------------------------------------------------
+
+DEFAULT_SIZES = (1, 1000, 10000)
+LAYOUTS = ("per-file", "single-file")
+SEED = 42
+# Area of the synthetic waypoints (south, west, north, east): northern Spain
+CORPUS_BOUNDS = (41.0, -9.0, 43.8, 3.0)
+# Zoom levels of the marker benchmarks: the first level with one marker per waypoint and an overview (clusters)
+DETAIL_ZOOM = 11
+OVERVIEW_ZOOM = 7
+# Size of the stand-in map in pixels
+VIEW_WIDTH = 1000
+VIEW_HEIGHT = 600
+
+# Time in ms importing garmin_waypoint_creator may take (best of --repeat fresh interpreters) and
+# the modules that must not be imported before the window is shown
+IMPORT_BUDGET_MS = 150
+DEFERRED_MODULES = ("garmin_waypoint_map", "tkintermapview", "requests", "PIL.Image", "PIL.ImageTk", "cProfile")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ICONS_DIR = os.path.join(BASE_DIR, "icons_garmin")
+
+# ------------------------------------------------------------------------------------------
+# Corpora
+# ------------------------------------------------------------------------------------------
+
+def synthetic_waypoints(count, seed=SEED):
+    """The same count waypoints on every run"""
+    rng = random.Random(seed)
+    symbols = list(GARMIN_ICONS.values())
+    south, west, north, east = CORPUS_BOUNDS
+    waypoints = []
+    for i in range(count):
+        name = f"Waypoint {i}"
+        links = (f"https://example.com/poi/{i}",) if i % 3 == 0 else ()
+        text = "Parkplatz am Ortsrand, Quelle 200 m weiter." if i % 2 == 0 else ""
+        waypoints.append(Waypoint(None, 0, round(rng.uniform(south, north), 6), round(rng.uniform(west, east), 6),
+                                  name, rng.choice(symbols), build_description(name, text, links), links,
+                                  "2026-10-17T08:00:00Z"))
+    return waypoints
+
+def write_corpus(directory, waypoints, layout):
+    """Write the waypoints into directory, one file per waypoint or all in one file"""
+    os.makedirs(directory, exist_ok=True)
+    if layout == "single-file":
+        with open(os.path.join(directory, "collection.gpx"), 'w', encoding='utf-8') as f:
+            with GpxWriter(f) as writer:
+                for waypoint in waypoints:
+                    writer.write_waypoint(waypoint)
+    else:
+        for i, waypoint in enumerate(waypoints):
+            with open(os.path.join(directory, f"wp{i:06d}.gpx"), 'w', encoding='utf-8') as f:
+                with GpxWriter(f) as writer:
+                    writer.write_waypoint(waypoint)
+    # Files of an earlier day, so the index cache can trust their mtimes as on a normal start
+    yesterday = time.time() - 86400
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            os.utime(entry.path, (yesterday, yesterday))
+
+# ------------------------------------------------------------------------------------------
+# Stand-ins for the map
+# ------------------------------------------------------------------------------------------
+
+class FakeMarker:
+    def __init__(self, lat, lon, text):
+        self.position = (lat, lon)
+        self.text = text
+
+    def delete(self):
+        pass
+
+    def set_text(self, text):
+        self.text = text
+
+    def set_position(self, lat, lon):
+        self.position = (lat, lon)
+
+class FakeMapView:
+    """The parts of the map widget the program reads: zoom, visible tiles and set_marker"""
+    def __init__(self, lat, lon, zoom):
+        self.zoom = zoom
+        x, y = world_xy(lat, lon)
+        tiles = 2 ** zoom
+        half_width = VIEW_WIDTH / 256 / 2
+        half_height = VIEW_HEIGHT / 256 / 2
+        self.upper_left_tile_pos = (x * tiles - half_width, y * tiles - half_height)
+        self.lower_right_tile_pos = (x * tiles + half_width, y * tiles + half_height)
+        self.markers = 0
+
+    def set_marker(self, lat, lon, text=None, **kwargs):
+        self.markers += 1
+        return FakeMarker(lat, lon, text)
+
+class FakeRoot:
+    def after(self, ms, callback):
+        pass
+
+    def after_idle(self, callback):
+        pass
+
+class NoIcons:
+    def get(self, key, size):
+        return None
+
+def marker_app(gui, store, zoom):
+    """GarminWaypointCreator without Tk window, on a stand-in map centred on the corpus"""
+    south, west, north, east = CORPUS_BOUNDS
+    app = gui.GarminWaypointCreator.__new__(gui.GarminWaypointCreator)
+    app.root = FakeRoot()
+    app.map_widget = FakeMapView((south + north) / 2, (west + east) / 2, zoom)
+    app.waypoint_store = store
+    app.map_markers = {}
+    app.cluster_markers = {}
+    app.cluster_update_pending = False
+    app.visible_bounds = None
+    app.symbols = SymbolRegistry(ICONS_DIR, GARMIN_ICONS)
+    app.icon_cache = NoIcons()
+    return app
+
+# ------------------------------------------------------------------------------------------
+# Benchmarks
+# ------------------------------------------------------------------------------------------
+
+class Benchmark:
+    """Runs timed functions and collects their results"""
+    def __init__(self, repeat, out=sys.stdout):
+        self.repeat = repeat
+        self.out = out
+        self.results = []
+
+    def run(self, name, function, setup=None, layout=None, size=None):
+        """Time function(state) repeat times; setup() makes a fresh state for every run and is not timed"""
+        times = []
+        for _ in range(self.repeat):
+            state = setup() if setup is not None else None
+            start = time.perf_counter()
+            function(state)
+            times.append(time.perf_counter() - start)
+        result = {"benchmark": name, "layout": layout, "size": size, "runs": len(times),
+                  "best_s": min(times), "median_s": statistics.median(times)}
+        if size:
+            result["per_waypoint_us"] = min(times) / size * 1e6
+        self.results.append(result)
+        print(f"{name:<22} {layout or '':<12} {size if size is not None else '':>7} "
+              f"{min(times) * 1000:10.2f} ms", file=self.out)
+
+    def skip(self, name, reason):
+        self.results.append({"benchmark": name, "skipped": reason})
+        print(f"{name:<22} übersprungen: {reason}", file=self.out)
+
+def load_store(directory, cluster_max_zoom, cache=None):
+    """What load_waypoints does: compare the folder (or restore it from the index cache),
+    parse on the worker pool, fill the store"""
+    store = WaypointStore(directory, cluster_max_zoom)
+    loader = WaypointLoader()
+    try:
+        changed, _ = store.diff() if cache is None else store.restore(cache)
+        loader.start(changed)
+        while loader.busy:
+            for gpx_file, signature, waypoints, check in loader.get_results(time_budget=1.0):
+                store.store_file(gpx_file, signature, waypoints, check)
+            time.sleep(0.001)
+    finally:
+        loader.shutdown()
+    return store
+
+def bench_corpus(bench, directory, waypoints, layout, cluster_max_zoom):
+    size = len(waypoints)
+    bench.run("load", lambda _: load_store(directory, cluster_max_zoom), layout=layout, size=size)
+
+    store = load_store(directory, cluster_max_zoom)
+    bench.run("refresh-unchanged", lambda _: store.diff(), layout=layout, size=size)
+
+    # Start with the index cache written by the previous run
+    cache = WaypointIndexCache(directory)
+    bench.run("index-write", lambda _: cache.write(store), layout=layout, size=size)
+    bench.run("load-warm", lambda _: load_store(directory, cluster_max_zoom, cache), layout=layout, size=size)
+
+    # Save one changed waypoint
+    changed = Waypoint(None, 0, waypoints[0].lat, waypoints[0].lon, "Geändert", waypoints[0].symbol,
+                       waypoints[0].desc, waypoints[0].links, waypoints[0].time)
+    if layout == "per-file":
+        target = os.path.join(directory, "wp000000.gpx")
+        bench.run("save", lambda _: atomic_write_gpx(target, [changed]), layout=layout, size=size)
+    else:
+        target = os.path.join(directory, "collection.gpx")
+        records = store.waypoints[store.filename_for("collection.gpx")]
+        collection = GpxCollection(target)
+        collection.scan()
+        index = size // 2
+        bench.run("save", lambda _: collection.apply([("put", index, changed)], records), layout=layout, size=size)
+    return store
+
+def bench_markers(bench, gui, store, size):
+    for name, zoom in (("markers-detail", DETAIL_ZOOM), ("markers-overview", OVERVIEW_ZOOM)):
+        bench.run(name, lambda app: app.update_visible_markers(),
+                  setup=lambda zoom=zoom: marker_app(gui, store, zoom), size=size)
+
+def bench_icons(bench, gui, workdir):
+    symbols = SymbolRegistry(ICONS_DIR, GARMIN_ICONS)
+    if not symbols.icon_paths:
+        bench.skip("icons", f"keine Icons in {ICONS_DIR}")
+        return
+    sizes = (gui.MAP_ICON_SIZE, gui.LARGE_ICON_SIZE)
+    atlas_dir = os.path.join(workdir, "atlas")
+    os.makedirs(atlas_dir, exist_ok=True)
+    try:
+        # Pillow is only imported by the first icon that is decoded
+        bench.run("icons-atlas-build", lambda _: gui.IconAtlas(symbols, sizes, [atlas_dir]).build())
+    except ImportError as e:
+        bench.skip("icons", str(e))
+        return
+    bench.run("icons-atlas-load", lambda _: gui.IconAtlas(symbols, sizes, [atlas_dir]).load())
+    atlas = gui.IconAtlas(symbols, sizes, [atlas_dir])
+    atlas.load()
+    bench.run("icons-crop-all", lambda _: [atlas.crop(key, gui.MAP_ICON_SIZE) for key in symbols.icon_paths],
+              size=len(symbols.icon_paths))
+    try:
+        root = gui.tk.Tk()
+        root.withdraw()
+    except gui.tk.TclError as e:
+        bench.skip("icons-prewarm", f"kein Display ({e})")
+        return
+    try:
+        keys = sorted(symbols.icon_paths)[:gui.ICON_PREWARM_COUNT]
+        bench.run("icons-prewarm", lambda cache: cache.prewarm(keys, gui.MAP_ICON_SIZE),
+                  setup=lambda: gui.IconCache(symbols, atlas), size=len(keys))
+    finally:
+        root.destroy()
+
+def bench_serialise(bench, waypoints):
+    """GpxWriter: the GPX text of the waypoints"""
+    def serialise(_):
+        content = io.StringIO()
+        with GpxWriter(content) as writer:
+            for waypoint in waypoints:
+                writer.write_waypoint(waypoint)
+        return content.getvalue()
+    bench.run("gpx-serialise", serialise, size=len(waypoints))
+
+def bench_search(bench, store, size):
+    """Building the search index on first use and typing a name letter by letter"""
+    def build(_):
+        store.search_index = None
+        store.search("")
+    bench.run("search-build", build, size=size)
+    query = "Waypoint 4711"
+    bench.run("search-typing", lambda _: [store.search(query[:i]) for i in range(1, len(query) + 1)], size=size)
+
+def bench_duplicates(bench, waypoints):
+    """find_duplicates over the corpus with every tenth waypoint saved a second time nearby"""
+    copies = [Waypoint(f"copy{i}.gpx", 0, waypoint.lat + 0.0001, waypoint.lon, waypoint.name.upper(), waypoint.symbol,
+                       waypoint.desc, waypoint.links, waypoint.time)
+              for i, waypoint in enumerate(waypoints[::10])]
+    bench.run("duplicates", lambda _: find_duplicates(waypoints + copies), size=len(waypoints) + len(copies))
+
+# ------------------------------------------------------------------------------------------
+# Import budget
+# ------------------------------------------------------------------------------------------
+
+def import_times(module, env=None):
+    """(name, depth, cumulative ms) of every module imported by `import module` in a fresh interpreter,
+    in the order -X importtime reports them (a module after the modules it imported)"""
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=BASE_DIR,
+                             capture_output=True, text=True, env=env)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    times = []
+    for line in process.stderr.splitlines():
+        # import time: <self us> | <cumulative us> | <name, indented by 2 per level>
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            name = fields[2].rstrip()
+            times.append((name.strip(), (len(name) - len(name.lstrip())) // 2, int(fields[1]) / 1000))
+    return times
+
+def direct_imports(times, module):
+    """(cumulative ms, name) of the modules imported directly by the top level module"""
+    names = [name for name, _, _ in times]
+    end = names.index(module)
+    start = end
+    while start > 0 and times[start - 1][1] > 0:
+        start -= 1
+    return [(ms, name) for name, depth, ms in times[start:end] if depth == 1]
+
+def check_import_budget(repeat, budget_ms=IMPORT_BUDGET_MS, module="garmin_waypoint_creator", out=sys.stdout):
+    """True if module imports within budget_ms without importing any of DEFERRED_MODULES"""
+    # Measured like an installed program: from bytecode, not from the sources. The first run
+    # compiles into a temporary cache folder, so nothing is written next to the sources.
+    with tempfile.TemporaryDirectory(prefix="gwc_pycache_") as cache:
+        env = dict(os.environ, PYTHONPYCACHEPREFIX=cache)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        import_times(module, env)
+        runs = [import_times(module, env) for _ in range(max(repeat, 1))]
+    best = min(ms for run in runs for name, depth, ms in run if name == module and depth == 0)
+    imported = {name for run in runs for name, _, _ in run}
+    early = [name for name in DEFERRED_MODULES if name in imported]
+    slowest = sorted(direct_imports(runs[-1], module), reverse=True)[:5]
+    print(f"import {module}: {best:.1f} ms (Budget {budget_ms} ms)", file=out)
+    for ms, name in slowest:
+        print(f"  {name:<40} {ms:8.1f} ms", file=out)
+    if early:
+        print(f"Zu früh importiert: {', '.join(early)}", file=out)
+    return best <= budget_ms and not early
+
+# ------------------------------------------------------------------------------------------
+# Results
+# ------------------------------------------------------------------------------------------
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"version": "1.5", "commit": commit, "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()}
+
+def compare(results, baseline, out=sys.stdout):
+    """Print new / old for every benchmark that is in both result sets"""
+    def key(result):
+        return (result["benchmark"], result.get("layout"), result.get("size"))
+    old = {key(r): r for r in baseline["results"] if "best_s" in r}
+    print(f"\n{'Benchmark':<22} {'Layout':<12} {'Größe':>7} {'alt ms':>10} {'neu ms':>10} {'neu/alt':>8}", file=out)
+    for result in results:
+        previous = old.get(key(result))
+        if previous is None or "best_s" not in result:
+            continue
+        ratio = result["best_s"] / previous["best_s"] if previous["best_s"] else float("inf")
+        print(f"{result['benchmark']:<22} {result.get('layout') or '':<12} {result.get('size') or '':>7} "
+              f"{previous['best_s'] * 1000:10.2f} {result['best_s'] * 1000:10.2f} {ratio:8.2f}", file=out)
+
+# ------------------------------------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="garmin_waypoint_benchmark",
+                                     description="Zeitmessung von Laden, Speichern, Markern und Icons")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="Anzahl Waypoints der Testdaten, z.B. 1,1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=3, help="Durchläufe je Messung (die beste zählt)")
+    parser.add_argument("-o", "--output", help="Ergebnisse als JSON in diese Datei schreiben")
+    parser.add_argument("--compare", metavar="JSON", help="mit den Ergebnissen einer anderen Version vergleichen")
+    parser.add_argument("--keep", action="store_true", help="Testdaten nicht löschen")
+    parser.add_argument("--import-budget", nargs="?", type=float, const=IMPORT_BUDGET_MS, metavar="MS",
+                        help=f"nur die Importzeit des Programms prüfen (Budget, Standard {IMPORT_BUDGET_MS} ms)")
+    args = parser.parse_args(argv)
+    if args.import_budget is not None:
+        return 0 if check_import_budget(args.repeat, args.import_budget) else 1
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+
+    # The program itself is needed for markers and icons (tkinter, tkintermapview, Pillow)
+    try:
+        import garmin_waypoint_creator as gui
+    except ImportError as e:
+        gui = None
+        gui_missing = str(e)
+    cluster_max_zoom = gui.CLUSTER_MAX_ZOOM if gui is not None else 0
+
+    bench = Benchmark(args.repeat)
+    workdir = tempfile.mkdtemp(prefix="gwc_benchmark_")
+    try:
+        for size in sizes:
+            waypoints = synthetic_waypoints(size)
+            stores = {}
+            for layout in LAYOUTS:
+                directory = os.path.join(workdir, f"{layout}-{size}")
+                write_corpus(directory, waypoints, layout)
+                stores[layout] = bench_corpus(bench, directory, waypoints, layout, cluster_max_zoom)
+            bench_serialise(bench, waypoints)
+            bench_search(bench, stores["per-file"], size)
+            bench_duplicates(bench, waypoints)
+            if gui is not None:
+                # The markers only depend on the waypoints, not on the layout of the files
+                bench_markers(bench, gui, stores["per-file"], size)
+            else:
+                bench.skip("markers", gui_missing)
+        if gui is not None:
+            bench_icons(bench, gui, workdir)
+        else:
+            bench.skip("icons", gui_missing)
+    finally:
+        if args.keep:
+            print(f"Testdaten in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    document = {"environment": environment(), "repeat": args.repeat, "results": bench.results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(document, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(bench.results, json.load(f))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
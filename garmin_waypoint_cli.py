@@ -0,0 +1,579 @@
+# ##########################################################################################
+# garmin_waypoint_cli
+# Hans Straßgütl
+#
+# Command line tool for batch jobs without a display. Creates, converts, merges and
+# validates Garmin GPX waypoints with the same code the program uses (garmin_waypoint_core).
+#
+#   python garmin_waypoint_cli.py create points.csv -o points.gpx
+#   python garmin_waypoint_cli.py create points.json --per-file waypoints/
+#   python garmin_waypoint_cli.py convert points.gpx -o points.csv
+#   python garmin_waypoint_cli.py merge *.gpx -o all.gpx
+#   python garmin_waypoint_cli.py validate *.gpx points.csv
+#   python garmin_waypoint_cli.py import pois.geojson -o pois.gpx --category-map categories.json
+#
+# CSV and JSON records have the fields name, lat, lon, symbol, text, links and time.
+# text is the plain description (title and links are added as the program does), links
+# is a list (JSON) or separated by "|" (CSV). JSON is either an array of records or one
+# record per line (.jsonl/.ndjson). GeoJSON points are read with their properties as the
+# record. All of them are read as a stream, one record at a time.
+# ..........................................................................................
+# More information: readme.md
+#
+# Changes:
+#   2026 10 17      Started.
+#                   Bulk import of CSV/GeoJSON POI lists on a process pool.
+#
+# ##########################################################################################
+# Version 1.5
+# ------------------------------------------------------------------------------------------
+# Global Imports
+# ------------------------------------------------------------------------------------------
+
+import argparse
+import csv
+import json
+import os
+import sys
+import io
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from garmin_waypoint_core import (GARMIN_ICONS, SymbolRegistry, Waypoint, GpxWriter, iter_gpx_waypoints,
+                                  atomic_write_gpx, atomic_write_bytes, encode_gpx, build_description,
+                                  description_text, creation_time_now, random_filename)
+
+# ------------------------------------------------------------------------------------------
+# Settings
+# ------------------------------------------------------------------------------------------
+
+ICONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "icons_garmin")
+RECORD_FIELDS = ["name", "lat", "lon", "symbol", "text", "links", "time"]
+JSON_LINES_SUFFIXES = (".jsonl", ".ndjson")
+GEOJSON_SUFFIXES = (".geojson",)
+
+# Bulk import: waypoints per worker job, and number of invalid rows that are listed
+IMPORT_CHUNK_SIZE = 2000
+IMPORT_REPORT_ROWS = 20
+
+# Characters read at a time from JSON and GeoJSON files
+JSON_READ_SIZE = 1 << 16
+
+# ------------------------------------------------------------------------------------------
+# Reading
+# ------------------------------------------------------------------------------------------
+
+class InputError(Exception):
+    """A record or file that cannot be turned into waypoints"""
+
+def input_format(path):
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".gpx":
+        return "gpx"
+    if suffix == ".csv":
+        return "csv"
+    if suffix in JSON_LINES_SUFFIXES:
+        return "jsonl"
+    if suffix == ".json":
+        return "json"
+    if suffix in GEOJSON_SUFFIXES:
+        return "geojson"
+    raise InputError(f"{path}: unbekanntes Format (gpx, csv, json, jsonl, geojson)")
+
+class JsonStream:
+    """Reads a large JSON document piece by piece, so an array of records never has
+    to be in memory as a whole: items() yields the values of an array one at a time.
+
+    Every value is decoded with json.JSONDecoder.raw_decode from a buffer that is
+    filled with JSON_READ_SIZE characters at a time and drops what was consumed.
+    """
+    def __init__(self, f, path):
+        self.f = f
+        self.path = path
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        """Read more of the file; False at its end"""
+        if self.eof:
+            return False
+        chunk = self.f.read(JSON_READ_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next character that is not blank ("" at the end of the file)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, chars):
+        """Consume the next character, which has to be one of chars"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise InputError(f"{self.path}: ungültiges JSON, '{chars}' erwartet")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next complete value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number followed by nothing but number characters may go on in the next
+                # chunk ("1." + "5", "-1" + "2", "1e" + "3"); all other values end themselves
+                cut = (isinstance(value, (int, float)) and not isinstance(value, bool)
+                       and not self.buffer[end:].lstrip("0123456789+-.eE"))
+                if not cut or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def items(self):
+        """Yield the values of the array that comes next"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+def read_records(path):
+    """Yield the records of a CSV or JSON file as dicts, one at a time"""
+    kind = input_format(path)
+    if kind == "csv":
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            yield from csv.DictReader(f)
+    elif kind == "jsonl":
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif kind == "json":
+        with open(path, encoding='utf-8') as f:
+            stream = JsonStream(f, path)
+            if stream.peek() != "[":
+                raise InputError(f"{path}: eine Liste von Waypoints wird erwartet")
+            yield from stream.items()
+    elif kind == "geojson":
+        yield from read_geojson(path)
+    else:
+        raise InputError(f"{path}: keine CSV- oder JSON-Datei")
+
+def geojson_record(feature):
+    """The properties of a feature plus lat/lon of the point.
+    Features that are no point get no lat/lon (and are rejected like any record without them)."""
+    if not isinstance(feature, dict):
+        feature = {}
+    record = dict(feature.get("properties") or {})
+    geometry = feature.get("geometry") or {}
+    coordinates = geometry.get("coordinates") or []
+    if geometry.get("type") == "Point" and len(coordinates) >= 2:
+        record["lon"], record["lat"] = coordinates[0], coordinates[1]
+    else:
+        record.pop("lat", None)
+        record.pop("lon", None)
+    return record
+
+def read_geojson(path):
+    """Records of the features of a GeoJSON file (a FeatureCollection or a single Feature).
+    The features array is streamed; the other members of the document are small."""
+    with open(path, encoding='utf-8') as f:
+        stream = JsonStream(f, path)
+        stream.expect("{")
+        document = {}
+        streamed = False
+        if stream.peek() == "}":
+            stream.pos += 1
+        else:
+            while True:
+                key = stream.value()
+                stream.expect(":")
+                if key == "features" and stream.peek() == "[":
+                    for feature in stream.items():
+                        yield geojson_record(feature)
+                    streamed = True
+                else:
+                    document[key] = stream.value()
+                if stream.expect(",}") == "}":
+                    break
+    if not streamed and document.get("type") != "FeatureCollection":
+        yield geojson_record(document)
+
+def record_links(links):
+    if not links:
+        return ()
+    if isinstance(links, str):
+        links = links.split("|")
+    return tuple(link.strip() for link in links if link and link.strip())
+
+def record_field(record, *names):
+    """First non-empty of several field names as text (partner lists name their columns differently)"""
+    for name in names:
+        value = record.get(name)
+        if value not in (None, ""):
+            return str(value).strip()
+    return ""
+
+def waypoint_from_record(record, symbols, filename, index, symbol=None):
+    """Waypoint for a CSV/JSON record, built like the edit window builds it"""
+    try:
+        lat = float(record["lat"])
+        lon = float(record["lon"])
+    except (KeyError, TypeError, ValueError):
+        raise InputError(f"{filename}:{index + 1}: lat/lon fehlt oder ist keine Zahl")
+    name = record_field(record, "name", "title")
+    links = record_links(record.get("links") or record.get("url") or record.get("website"))
+    if symbol is None:
+        symbol = record_field(record, "symbol", "sym") or "Waypoint"
+        key = symbols.key_for(symbol)
+        if key is not None:
+            symbol = symbols.symbol_for(key)
+    text = record_field(record, "text", "description")
+    return Waypoint(filename, index, lat, lon, name, symbol, build_description(name, text, links),
+                    links, record.get("time") or creation_time_now())
+
+def read_waypoints(path, symbols):
+    """Yield the waypoints of a GPX, CSV or JSON file"""
+    if input_format(path) == "gpx":
+        yield from iter_gpx_waypoints(path)
+        return
+    for index, record in enumerate(read_records(path)):
+        yield waypoint_from_record(record, symbols, path, index)
+
+def expand_inputs(paths):
+    """Input files; a folder stands for all GPX files in it"""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.gpx') and not name.startswith('.'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def read_all(paths, symbols):
+    for path in expand_inputs(paths):
+        yield from read_waypoints(path, symbols)
+
+# ------------------------------------------------------------------------------------------
+# Writing
+# ------------------------------------------------------------------------------------------
+
+def waypoint_record(waypoint):
+    return {
+        "name": waypoint.name,
+        "lat": waypoint.lat,
+        "lon": waypoint.lon,
+        "symbol": waypoint.symbol,
+        "text": description_text(waypoint.desc or ""),
+        "links": list(waypoint.links),
+        "time": waypoint.time,
+    }
+
+def geojson_feature(waypoint):
+    """GeoJSON point feature of a waypoint; the other fields are its properties"""
+    properties = waypoint_record(waypoint)
+    del properties["lat"], properties["lon"]
+    return {"type": "Feature", "geometry": {"type": "Point", "coordinates": [waypoint.lon, waypoint.lat]},
+            "properties": properties}
+
+def write_waypoints(output, waypoints):
+    """Write waypoints into a GPX, CSV, JSON or GeoJSON file (by its suffix); returns their number"""
+    count = 0
+    def counted():
+        nonlocal count
+        for waypoint in waypoints:
+            count += 1
+            yield waypoint
+
+    kind = input_format(output)
+    if kind == "gpx":
+        atomic_write_gpx(output, counted())
+    elif kind == "csv":
+        with open(output, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, RECORD_FIELDS)
+            writer.writeheader()
+            for waypoint in counted():
+                record = waypoint_record(waypoint)
+                record["links"] = "|".join(record["links"])
+                writer.writerow(record)
+    elif kind == "jsonl":
+        with open(output, 'w', encoding='utf-8') as f:
+            for waypoint in counted():
+                f.write(json.dumps(waypoint_record(waypoint), ensure_ascii=False) + "\n")
+    elif kind == "geojson":
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write('{"type": "FeatureCollection", "features": [')
+            for waypoint in counted():
+                f.write(("\n  " if count == 1 else ",\n  ") + json.dumps(geojson_feature(waypoint), ensure_ascii=False))
+            f.write("\n]}\n")
+    else:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write("[")
+            for waypoint in counted():
+                f.write(("\n  " if count == 1 else ",\n  ") + json.dumps(waypoint_record(waypoint), ensure_ascii=False))
+            f.write("\n]\n")
+    return count
+
+def write_single_files(directory, waypoints):
+    """One GPX file per waypoint, as the program saves them"""
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    for waypoint in waypoints:
+        while True:
+            filename = os.path.join(directory, random_filename())
+            if not os.path.exists(filename):
+                break
+        atomic_write_gpx(filename, [waypoint])
+        count += 1
+    return count
+
+# ------------------------------------------------------------------------------------------
+# Validation
+# ------------------------------------------------------------------------------------------
+
+def waypoint_problems(waypoint, symbols):
+    """Messages for everything BaseCamp or the devices would not accept"""
+    problems = []
+    if not -90.0 <= waypoint.lat <= 90.0:
+        problems.append(f"Breite {waypoint.lat} außerhalb -90..90")
+    if not -180.0 <= waypoint.lon <= 180.0:
+        problems.append(f"Länge {waypoint.lon} außerhalb -180..180")
+    if not waypoint.name or not waypoint.name.strip():
+        problems.append("Name fehlt")
+    if not waypoint.symbol:
+        problems.append("Symbol fehlt")
+    elif symbols.key_for(waypoint.symbol) is None:
+        problems.append(f"unbekanntes Symbol '{waypoint.symbol}'")
+    return problems
+
+def validate(paths, symbols, out=sys.stdout):
+    """Report the problems of all waypoints; returns the number of problems.
+    A bad CSV/JSON record is reported and the check goes on with the next one;
+    only a file that cannot be read at all ends the check of that file."""
+    problems = 0
+    for path in expand_inputs(paths):
+        try:
+            if input_format(path) == "gpx":
+                items = iter_gpx_waypoints(path)
+            else:
+                items = read_records(path)
+            for index, item in enumerate(items):
+                if isinstance(item, Waypoint):
+                    waypoint = item
+                else:
+                    try:
+                        waypoint = waypoint_from_record(item, symbols, path, index)
+                    except InputError as e:
+                        print(e, file=out)
+                        problems += 1
+                        continue
+                for problem in waypoint_problems(waypoint, symbols):
+                    print(f"{path}:{index + 1}: {problem}", file=out)
+                    problems += 1
+        except Exception as e:
+            print(f"{path}: {e}", file=out)
+            problems += 1
+    return problems
+
+# ------------------------------------------------------------------------------------------
+# Bulk import
+# ------------------------------------------------------------------------------------------
+
+class CategorySymbols:
+    """<sym> value for the category of a POI.
+
+    The category is looked up in the mapping (category -> icon name, e.g. from
+    --category-map), then as an icon name itself; unknown categories get the default.
+    """
+    def __init__(self, symbols, mapping=None, default="Waypoint"):
+        self.symbols = symbols
+        self.mapping = {category.casefold(): icon for category, icon in (mapping or {}).items()}
+        self.default = symbols.symbol_for(symbols.key_for(default) or default)
+        self.cache = {}
+
+    def symbol_for(self, category):
+        category = (category or "").strip().casefold()
+        symbol = self.cache.get(category)
+        if symbol is None:
+            key = self.symbols.key_for(self.mapping.get(category, category))
+            symbol = self.cache[category] = self.symbols.symbol_for(key) if key else self.default
+        return symbol
+
+def serialise_waypoints(waypoints):
+    """GPX bytes of the <wpt> elements of some waypoints (runs in a worker process)"""
+    content = io.StringIO()
+    writer = GpxWriter(content)
+    for waypoint in waypoints:
+        writer.write_waypoint(waypoint)
+    return encode_gpx(content.getvalue())
+
+def gpx_frame():
+    """GPX bytes before and after the <wpt> elements"""
+    head, tail = io.StringIO(), io.StringIO()
+    GpxWriter(head).start()
+    GpxWriter(tail).end()
+    return encode_gpx(head.getvalue()), encode_gpx(tail.getvalue())
+
+def import_waypoints(paths, symbols, categories, category_field, rejected):
+    """Yield the valid waypoints of the POI lists; rejected rows are appended to rejected"""
+    for path in paths:
+        for index, record in enumerate(read_records(path)):
+            symbol = None
+            if category_field in record:
+                symbol = categories.symbol_for(record.get(category_field))
+            try:
+                waypoint = waypoint_from_record(record, symbols, path, index, symbol)
+            except InputError as e:
+                rejected.append(str(e))
+                continue
+            problems = [p for p in waypoint_problems(waypoint, symbols) if not p.startswith("unbekanntes Symbol")]
+            if problems:
+                rejected.append(f"{path}:{index + 1}: {', '.join(problems)}")
+                continue
+            yield waypoint
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def bulk_write_gpx(output, waypoints, workers):
+    """Write waypoints into one GPX file, serialising chunks of them on a process pool.
+    Reading the input continues while the workers run; at most two chunks per worker
+    are in flight, so memory use does not depend on the size of the input."""
+    count = 0
+    head, tail = gpx_frame()
+
+    def chunks():
+        nonlocal count
+        yield head
+        if workers <= 1:
+            for chunk in chunked(waypoints, IMPORT_CHUNK_SIZE):
+                count += len(chunk)
+                yield serialise_waypoints(chunk)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                in_flight = deque()
+                for chunk in chunked(waypoints, IMPORT_CHUNK_SIZE):
+                    count += len(chunk)
+                    in_flight.append(executor.submit(serialise_waypoints, chunk))
+                    if len(in_flight) >= 2 * workers:
+                        yield in_flight.popleft().result()
+                while in_flight:
+                    yield in_flight.popleft().result()
+        yield tail
+
+    atomic_write_bytes(output, chunks())
+    return count
+
+def bulk_import(args, symbols):
+    mapping = None
+    if args.category_map:
+        with open(args.category_map, encoding='utf-8') as f:
+            mapping = json.load(f)
+    categories = CategorySymbols(symbols, mapping, args.default_symbol)
+    rejected = []
+    start = time.perf_counter()
+    waypoints = import_waypoints(args.inputs, symbols, categories, args.category_field, rejected)
+    count = bulk_write_gpx(args.output, waypoints, args.workers)
+    seconds = time.perf_counter() - start
+
+    for message in rejected[:IMPORT_REPORT_ROWS]:
+        print(f"übersprungen: {message}")
+    if len(rejected) > IMPORT_REPORT_ROWS:
+        print(f"... und {len(rejected) - IMPORT_REPORT_ROWS} weitere")
+    print(f"{count} Waypoints nach {args.output} geschrieben, {len(rejected)} übersprungen, "
+          f"{seconds:.2f} s ({count / max(seconds, 1e-9):.0f} Waypoints/s)")
+
+# ------------------------------------------------------------------------------------------
+# Command line
+# ------------------------------------------------------------------------------------------
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="garmin_waypoint_cli",
+                                     description="Garmin GPX Waypoints ohne Oberfläche erstellen und bearbeiten")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    create = commands.add_parser("create", help="Waypoints aus CSV/JSON erstellen")
+    create.add_argument("inputs", nargs="+", help="CSV- oder JSON-Dateien")
+    target = create.add_mutually_exclusive_group(required=True)
+    target.add_argument("-o", "--output", help="eine GPX-Datei mit allen Waypoints")
+    target.add_argument("--per-file", metavar="ORDNER", help="eine GPX-Datei je Waypoint in diesem Ordner")
+
+    convert = commands.add_parser("convert", help="zwischen GPX, CSV und JSON umwandeln")
+    convert.add_argument("input")
+    convert.add_argument("-o", "--output", required=True, help="Zieldatei (.gpx, .csv, .json, .jsonl, .geojson)")
+
+    merge = commands.add_parser("merge", help="Waypoints mehrerer Dateien in eine Datei schreiben")
+    merge.add_argument("inputs", nargs="+", help="Dateien oder Ordner mit GPX-Dateien")
+    merge.add_argument("-o", "--output", required=True)
+
+    check = commands.add_parser("validate", help="Waypoints prüfen")
+    check.add_argument("inputs", nargs="+", help="Dateien oder Ordner mit GPX-Dateien")
+
+    bulk = commands.add_parser("import", help="große POI-Listen (CSV/GeoJSON) in eine GPX-Datei übernehmen")
+    bulk.add_argument("inputs", nargs="+", help="CSV-, JSON- oder GeoJSON-Dateien")
+    bulk.add_argument("-o", "--output", required=True, help="GPX-Datei")
+    bulk.add_argument("--category-field", default="category", help="Feld mit der Kategorie (Standard: category)")
+    bulk.add_argument("--category-map", metavar="JSON", help="Zuordnung Kategorie -> Garmin-Symbol als JSON-Datei")
+    bulk.add_argument("--default-symbol", default="Waypoint", help="Symbol für unbekannte Kategorien")
+    bulk.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Prozesse für die GPX-Erzeugung")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    symbols = SymbolRegistry(ICONS_DIR, GARMIN_ICONS)
+    try:
+        if args.command == "create":
+            for path in args.inputs:
+                if input_format(path) == "gpx":
+                    raise InputError(f"{path}: create erwartet CSV oder JSON, für GPX gibt es convert/merge")
+            waypoints = read_all(args.inputs, symbols)
+            if args.per_file:
+                count = write_single_files(args.per_file, waypoints)
+                print(f"{count} Waypoints in {args.per_file} erstellt")
+            else:
+                count = write_waypoints(args.output, waypoints)
+                print(f"{count} Waypoints nach {args.output} geschrieben")
+        elif args.command in ("convert", "merge"):
+            inputs = [args.input] if args.command == "convert" else args.inputs
+            count = write_waypoints(args.output, read_all(inputs, symbols))
+            print(f"{count} Waypoints nach {args.output} geschrieben")
+        elif args.command == "import":
+            bulk_import(args, symbols)
+        elif args.command == "validate":
+            problems = validate(args.inputs, symbols)
+            if problems:
+                print(f"{problems} Probleme gefunden")
+                return 1
+            print("Keine Probleme gefunden")
+    except (InputError, OSError, ValueError, ET.ParseError) as e:
+        print(f"Fehler: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1820 @@
+# ##########################################################################################
+# garmin_waypoint_core
+# Hans Straßgütl
+#
+# The part of garmin_waypoint_creator that needs no display: waypoint records, reading and
+# writing Garmin GPX files, the waypoint stores and the Garmin symbols. Used by the program
+# (garmin_waypoint_creator.py) and by the command line tool (garmin_waypoint_cli.py).
+# ..........................................................................................
+# More information: readme.md
+#
+# Changes:
+#   2026 10 17      Split off from garmin_waypoint_creator.
+#                   GPX files are read as a stream; GPX 1.0 and files without namespace work.
+#                   Compact waypoint records (__slots__, shared strings).
+#                   Folder watcher for GPX files changed by other programs.
+#                   Opt-in instrumentation of the hot paths.
+#                   Modules that not every start needs are imported on first use.
+#                   Index cache of the parsed waypoints for fast warm starts.
+#                   Search index over name, text and symbol of the waypoints.
+#                   Finder for duplicate waypoints (spatial hashing).
+#
+# ##########################################################################################
+# Version 1.5
+# ------------------------------------------------------------------------------------------
+# Global Imports
+# ------------------------------------------------------------------------------------------
+
+from datetime import datetime
+import xml.etree.ElementTree as ET
+import random
+import string
+import os
+import io
+import re
+import threading
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import math
+import select
+import struct
+import json
+import functools
+import hashlib
+import marshal
+import bisect
+import heapq
+import unicodedata
+import difflib
+
+# ------------------------------------------------------------------------------------------
+# Instrumentation
+# ------------------------------------------------------------------------------------------
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class Timer:
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.add(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+class Instrumentation:
+    """Timings and counters of the hot paths, off unless enabled (GWC_PROFILE=1 or --profile).
+
+    Code marks a path with `with instrumentation.timer("name"):` (or the timed()
+    decorator) and counts events with count(); while disabled both cost a single
+    attribute check. Every timed
+    call is also kept as a trace event (up to MAX_TRACE_EVENTS), and dump_json()
+    writes timings, counters and trace in the Chrome trace format, which
+    chrome://tracing and Perfetto can show.
+    """
+    MAX_TRACE_EVENTS = 200000
+    NULL_TIMER = NullTimer()
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.timings = {}   # name -> [count, total, max, last] in seconds
+        self.counters = {}  # name -> number
+        self.trace = []     # (name, start, duration, thread name)
+
+    def enable(self):
+        self.enabled = True
+
+    def timer(self, name):
+        if not self.enabled:
+            return self.NULL_TIMER
+        return Timer(self, name)
+
+    def timed(self, name):
+        """Decorator form of timer()"""
+        def decorate(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with Timer(self, name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def add(self, name, start, duration):
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = [0, 0.0, 0.0, 0.0]
+            timing[0] += 1
+            timing[1] += duration
+            timing[2] = max(timing[2], duration)
+            timing[3] = duration
+            if len(self.trace) < self.MAX_TRACE_EVENTS:
+                self.trace.append((name, start, duration, threading.current_thread().name))
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        """Copy of the timings and counters"""
+        with self.lock:
+            return {name: list(timing) for name, timing in self.timings.items()}, dict(self.counters)
+
+    def dump_json(self, filename):
+        timings, counters = self.snapshot()
+        with self.lock:
+            trace = list(self.trace)
+        threads = {}
+        events = [{"name": name, "ph": "X", "pid": 1, "tid": threads.setdefault(thread, len(threads) + 1),
+                   "ts": round((start - self.origin) * 1e6), "dur": round(duration * 1e6)}
+                  for name, start, duration, thread in trace]
+        events += [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": thread}}
+                   for thread, tid in threads.items()]
+        document = {
+            "traceEvents": events,
+            "timings": {name: {"count": count, "total_ms": total * 1000, "max_ms": longest * 1000,
+                               "last_ms": last * 1000}
+                        for name, (count, total, longest, last) in timings.items()},
+            "counters": counters,
+        }
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(document, f)
+
+instrumentation = Instrumentation()
+
+# ------------------------------------------------------------------------------------------
+# Waypoint store
+# ------------------------------------------------------------------------------------------
+
+class Waypoint:
+    """One <wpt> of a GPX file as it is held in the waypoint store.
+    (filename, index) identifies it: index is the position of the <wpt> in its file.
+
+    The same record is used by the loader, the store indexes and the map markers.
+    It is slotted and shares the file name and symbol strings between all
+    waypoints. Memory target: at most 700 bytes per waypoint with typical texts,
+    including the grid and cluster indexes (measured: about 550 + 135 bytes),
+    i.e. below 70 MB for 100k waypoints.
+    """
+    __slots__ = ("filename", "index", "lat", "lon", "name", "symbol", "desc", "links", "time")
+
+    def __init__(self, filename, index, lat, lon, name, symbol, desc="", links=(), time=None):
+        self.filename = sys.intern(filename) if filename else filename
+        self.index = index
+        self.lat = lat
+        self.lon = lon
+        self.name = name
+        self.symbol = sys.intern(symbol) if symbol else symbol
+        self.desc = desc
+        self.links = links
+        self.time = time  # Garmin creation time as written in the file
+
+    @property
+    def id(self):
+        return (self.filename, self.index)
+
+GPX_SKIPPED_ELEMENTS = {"trk", "rte"}  # subtrees that hold no waypoints
+
+def local_name(tag):
+    """Element name without its namespace, so GPX 1.0, 1.1 and files without namespace all match"""
+    return tag.rsplit('}', 1)[-1]
+
+def waypoint_from_element(gpx_file, index, wpt):
+    """Waypoint record of a <wpt> element"""
+    lat = float(wpt.get('lat'))
+    lon = float(wpt.get('lon'))
+    children = {}  # first child per element name
+    links = []
+    creation_time = None
+    for child in wpt:
+        tag = local_name(child.tag)
+        if tag == 'link':
+            if child.get('href'):
+                links.append(child.get('href'))
+        elif tag == 'url':
+            # GPX 1.0 has <url> instead of <link>
+            if child.text and child.text.strip():
+                links.append(child.text.strip())
+        elif tag == 'extensions':
+            for element in child.iter():
+                if local_name(element.tag) == 'CreationTime' and creation_time is None:
+                    creation_time = element.text
+        else:
+            children.setdefault(tag, child)
+
+    # Get waypoint name
+    name_elem = children.get('name')
+    name = name_elem.text if name_elem is not None else "Unbenannt"
+
+    # Get symbol/icon
+    sym_elem = children.get('sym')
+    symbol = sym_elem.text if sym_elem is not None else "Waypoint"
+
+    # Description and links are kept for the edit window
+    desc_elem = children.get('desc')
+    desc = (desc_elem.text or "") if desc_elem is not None else ""
+    return Waypoint(gpx_file, index, lat, lon, name, symbol, desc, tuple(links), creation_time)
+
+def iter_gpx_waypoints(gpx_file, source=None):
+    """Yield the waypoints of a GPX file while it is read.
+
+    The file is read with iterparse: every finished top-level element is dropped
+    again and the elements inside <trk> and <rte> are cleared as soon as they end,
+    so memory stays small even for large BaseCamp exports with long tracks.
+    source is an already opened binary file to read instead of gpx_file.
+    """
+    index = 0
+    stack = []  # open elements
+    skip_depth = None  # depth of the <trk>/<rte> that is being skipped
+    for event, element in ET.iterparse(source if source is not None else gpx_file, events=("start", "end")):
+        if event == "start":
+            stack.append(element)
+            if skip_depth is None and local_name(element.tag) in GPX_SKIPPED_ELEMENTS:
+                skip_depth = len(stack)
+            continue
+
+        stack.pop()
+        depth = len(stack)
+        if skip_depth is not None:
+            if depth < skip_depth:
+                skip_depth = None
+            else:
+                # Drop the finished children of a skipped element right away
+                stack[-1].clear()
+                continue
+        elif local_name(element.tag) == 'wpt':
+            yield waypoint_from_element(gpx_file, index, element)
+            index += 1
+        if depth == 1:
+            # A finished child of <gpx> is not needed any more
+            stack[0].clear()
+
+class DigestReader:
+    """Binary file that computes the digest of everything read from it"""
+    def __init__(self, f):
+        self.f = f
+        self.hash = hashlib.blake2b(digest_size=16)
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.hash.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+def read_gpx_file_checked(gpx_file):
+    """Parse a GPX file, reporting errors instead of raising them.
+    Broken files yield no waypoints; they are remembered anyway so they are not
+    parsed again until they change.
+
+    Returns (waypoints, check): check = (mtime_ns, size, digest, checked_ns) of
+    exactly the bytes that were parsed, checked_ns being the time just before
+    they were read (see WaypointIndexCache). check is None if the file could not
+    be read or changed while it was read.
+    """
+    try:
+        checked_ns = time.time_ns()
+        with open(gpx_file, 'rb') as f:
+            before = os.fstat(f.fileno())
+            reader = DigestReader(f)
+            with instrumentation.timer("parse_gpx"):
+                waypoints = list(iter_gpx_waypoints(gpx_file, reader))
+            after = os.fstat(f.fileno())
+        instrumentation.count("files_parsed")
+        instrumentation.count("waypoints_parsed", len(waypoints))
+    except Exception as e:
+        print(f"Fehler beim Laden von {gpx_file}: {e}")
+        return [], None
+    if (before.st_mtime_ns, before.st_size) != (after.st_mtime_ns, after.st_size):
+        return waypoints, None
+    return waypoints, (after.st_mtime_ns, after.st_size, reader.hexdigest(), checked_ns)
+
+def read_gpx_file(gpx_file):
+    """Waypoints of a GPX file, [] if it cannot be read (see read_gpx_file_checked)"""
+    return read_gpx_file_checked(gpx_file)[0]
+
+def file_check(path):
+    """(mtime_ns, size, digest, checked_ns) of a file as in read_gpx_file_checked, or None"""
+    try:
+        checked_ns = time.time_ns()
+        with open(path, 'rb') as f:
+            before = os.fstat(f.fileno())
+            reader = DigestReader(f)
+            while reader.read(1024 * 1024):
+                pass
+            after = os.fstat(f.fileno())
+    except OSError:
+        return None
+    if (before.st_mtime_ns, before.st_size) != (after.st_mtime_ns, after.st_size):
+        return None
+    return (after.st_mtime_ns, after.st_size, reader.hexdigest(), checked_ns)
+
+def is_gpx_name(name):
+    """GPX file as the program sees it (hidden files such as the temporary files of a save are left out)"""
+    return name.endswith('.gpx') and not name.startswith('.')
+
+def scan_gpx_folder(directory):
+    """Return a dict name -> (mtime_ns, size) of all GPX files in a folder"""
+    signatures = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not is_gpx_name(entry.name):
+                continue
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    signatures[entry.name] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                # File vanished between listing and stat
+                continue
+    return signatures
+
+def file_signature(gpx_file):
+    """(mtime_ns, size) of a file or None if it does not exist"""
+    try:
+        stat = os.stat(gpx_file)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+class WaypointGrid:
+    """Uniform lat/lon grid over the waypoints for fast bounding box queries"""
+    def __init__(self, cell_size=0.25):
+        self.cell_size = cell_size  # degrees
+        self.cells = {}  # (row, col) -> set of Waypoint
+
+    def cell_of(self, lat, lon):
+        return (math.floor(lat / self.cell_size), math.floor(lon / self.cell_size))
+
+    def add(self, waypoint):
+        self.cells.setdefault(self.cell_of(waypoint.lat, waypoint.lon), set()).add(waypoint)
+
+    def remove(self, waypoint):
+        cell = self.cell_of(waypoint.lat, waypoint.lon)
+        members = self.cells.get(cell)
+        if members is not None:
+            members.discard(waypoint)
+            if not members:
+                del self.cells[cell]
+
+    def query(self, bounds):
+        """Yield all waypoints inside bounds = (south, west, north, east)"""
+        south, west, north, east = bounds
+        row_min, col_min = self.cell_of(south, west)
+        row_max, col_max = self.cell_of(north, east)
+        if (row_max - row_min + 1) * (col_max - col_min + 1) > len(self.cells):
+            # Large area (low zoom): walking the occupied cells is cheaper
+            cells = [members for (row, col), members in self.cells.items()
+                     if row_min <= row <= row_max and col_min <= col <= col_max]
+        else:
+            cells = [self.cells[(row, col)]
+                     for row in range(row_min, row_max + 1)
+                     for col in range(col_min, col_max + 1)
+                     if (row, col) in self.cells]
+        for members in cells:
+            for waypoint in members:
+                if south <= waypoint.lat <= north and west <= waypoint.lon <= east:
+                    yield waypoint
+
+def world_xy(lat, lon):
+    """Web Mercator position of a coordinate, normalised to 0..1 in both axes"""
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    x = (lon + 180.0) / 360.0
+    lat_rad = math.radians(lat)
+    y = (1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0
+    return min(max(x, 0.0), 1.0 - 1e-12), min(max(y, 0.0), 1.0 - 1e-12)
+
+def world_to_latlon(x, y):
+    """Inverse of world_xy"""
+    lon = x * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * y))))
+    return lat, lon
+
+class WaypointClusters:
+    """Number and centre of the waypoints per screen cell for every clustered zoom level.
+
+    A cell covers CELL_PX x CELL_PX screen pixels at its zoom level. The cells of
+    two neighbouring levels nest like a quadtree, so adding or removing a waypoint
+    updates every level in O(levels), and a zoom change only reads the level that
+    is already aggregated instead of clustering from scratch.
+    """
+    CELL_PX = 64
+
+    def __init__(self, max_zoom):
+        self.max_zoom = max_zoom  # levels 0 .. max_zoom - 1 are clustered
+        self.cells_per_tile_bits = int(math.log2(256 // self.CELL_PX))
+        self.levels = [{} for _ in range(max_zoom)]  # per zoom: (cx, cy) -> [count, sum_lat, sum_lon]
+
+    def finest_cell(self, waypoint):
+        bits = self.max_zoom - 1 + self.cells_per_tile_bits
+        x, y = world_xy(waypoint.lat, waypoint.lon)
+        return int(x * (1 << bits)), int(y * (1 << bits))
+
+    def update(self, waypoint, delta):
+        if not self.max_zoom:
+            return
+        cx, cy = self.finest_cell(waypoint)
+        for zoom in range(self.max_zoom - 1, -1, -1):
+            cells = self.levels[zoom]
+            cell = cells.get((cx, cy))
+            if cell is None:
+                cell = cells[(cx, cy)] = [0, 0.0, 0.0]
+            cell[0] += delta
+            cell[1] += delta * waypoint.lat
+            cell[2] += delta * waypoint.lon
+            if cell[0] <= 0:
+                del cells[(cx, cy)]
+            cx >>= 1
+            cy >>= 1
+
+    def add(self, waypoint):
+        self.update(waypoint, 1)
+
+    def remove(self, waypoint):
+        self.update(waypoint, -1)
+
+    def clustered(self, zoom):
+        return 0 <= zoom < self.max_zoom
+
+    def cell_bounds(self, zoom, cell):
+        """(south, west, north, east) of a cell"""
+        size = 1 << (zoom + self.cells_per_tile_bits)
+        north, west = world_to_latlon(cell[0] / size, cell[1] / size)
+        south, east = world_to_latlon((cell[0] + 1) / size, (cell[1] + 1) / size)
+        return south, west, north, east
+
+    def query(self, zoom, bounds):
+        """Yield (cell, count, lat, lon) of all cells of a zoom level inside bounds"""
+        cells = self.levels[zoom]
+        size = 1 << (zoom + self.cells_per_tile_bits)
+        south, west, north, east = bounds
+        x_min, y_min = (int(v * size) for v in world_xy(north, west))
+        x_max, y_max = (int(v * size) for v in world_xy(south, east))
+        if (x_max - x_min + 1) * (y_max - y_min + 1) > len(cells):
+            candidates = [(c, v) for c, v in cells.items()
+                          if x_min <= c[0] <= x_max and y_min <= c[1] <= y_max]
+        else:
+            candidates = [((cx, cy), cells[(cx, cy)])
+                          for cx in range(x_min, x_max + 1)
+                          for cy in range(y_min, y_max + 1)
+                          if (cx, cy) in cells]
+        for cell, (count, sum_lat, sum_lon) in candidates:
+            yield cell, count, sum_lat / count, sum_lon / count
+
+SEARCH_WORD = re.compile(r"\w+")
+SEARCH_MARKS = re.compile(r"[\u0300-\u036f]")  # combining accents after NFKD
+SEARCH_TAG = re.compile(r"<[^>]*>")
+
+def search_words(text):
+    """Words of a text as the search compares them: lower case and without accents ("Café" -> "cafe")"""
+    return SEARCH_WORD.findall(SEARCH_MARKS.sub("", unicodedata.normalize("NFKD", text.casefold())))
+
+class WaypointSearch:
+    """Finds waypoints by the beginnings of the words in their name, text and symbol.
+
+    A token index maps every word to its waypoints; the words themselves are kept
+    in a sorted list, so the words starting with a typed prefix are one bisect range
+    (a prefix trie would answer the same, but costs far more memory per word).
+    All words of a query have to match, starting with the rarest one: few candidates
+    are checked word by word, many are intersected with the waypoints of the next
+    query word, so a query costs about the number of waypoints it finds.
+    """
+    def __init__(self, waypoints=()):
+        self.postings = {}  # word -> set of Waypoint
+        for waypoint in waypoints:
+            for word in self.words_of(waypoint):
+                self.postings.setdefault(word, set()).add(waypoint)
+        self.words = sorted(self.postings)
+
+    @staticmethod
+    def words_of(waypoint):
+        text = SEARCH_TAG.sub(" ", description_text(waypoint.desc or ""))
+        return set(search_words(f"{waypoint.name or ''} {text} {waypoint.symbol or ''}"))
+
+    def add(self, waypoint):
+        for word in self.words_of(waypoint):
+            waypoints = self.postings.get(word)
+            if waypoints is None:
+                waypoints = self.postings[word] = set()
+                bisect.insort(self.words, word)
+            waypoints.add(waypoint)
+
+    def remove(self, waypoint):
+        for word in self.words_of(waypoint):
+            waypoints = self.postings.get(word)
+            if waypoints is None:
+                continue
+            waypoints.discard(waypoint)
+            if not waypoints:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+
+    def words_with_prefix(self, prefix):
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + "\U0010ffff")
+        return self.words[start:end]
+
+    def search(self, query, limit=50):
+        """Up to limit waypoints with a word starting with every word of query;
+        those whose name starts with the query come first, then by name"""
+        prefixes = sorted(set(search_words(query)), key=len, reverse=True)
+        if not prefixes:
+            return []
+        matches = []  # (number of waypoints, prefix, words)
+        for prefix in prefixes:
+            words = self.words_with_prefix(prefix)
+            matches.append((sum(len(self.postings[word]) for word in words), prefix, words))
+        matches.sort()
+        candidates = set()
+        for word in matches[0][2]:
+            candidates.update(self.postings[word])
+        for size, prefix, words in matches[1:]:
+            if len(candidates) * 16 < size:
+                candidates = {waypoint for waypoint in candidates
+                              if any(word.startswith(prefix) for word in self.words_of(waypoint))}
+            else:
+                found = set()
+                for word in words:
+                    found.update(self.postings[word])
+                candidates &= found
+        start = query.strip().casefold()
+
+        def rank(waypoint):
+            name = (waypoint.name or "").casefold()
+            return (not name.startswith(start), name, waypoint.filename or "", waypoint.index)
+        return heapq.nsmallest(limit, candidates, key=rank)
+
+class WaypointStore:
+    """Keeps the parsed waypoints of all GPX files of a directory in memory.
+
+    Every file is remembered together with its (mtime, size). A refresh only
+    stats the directory and re-parses the files whose signature changed, so a
+    single save costs one parse instead of a parse of the whole folder.
+    """
+    database = False  # saving is left to the save queue, which writes the GPX files
+
+    def __init__(self, directory=".", cluster_max_zoom=0):
+        self.directory = directory
+        self.signatures = {}  # filename -> (mtime_ns, size)
+        self.waypoints = {}   # filename -> [Waypoint, ...]
+        self.grid = WaypointGrid()
+        self.clusters = WaypointClusters(cluster_max_zoom)
+        self.pending = set()  # files saved in memory but not yet written by the save queue
+        self.checks = {}      # filename -> (mtime_ns, size, digest, checked_ns) of the parsed bytes
+        self.index_outdated = False  # changed since the index cache was written
+        self.search_index = None  # WaypointSearch, built on the first search
+
+    def scan(self):
+        """Return a dict filename -> (mtime_ns, size) of all GPX files in the directory"""
+        return {self.filename_for(name): signature for name, signature in scan_gpx_folder(self.directory).items()}
+
+    def filename_for(self, name):
+        """Filename as used by the program (relative to the working directory)"""
+        if self.directory in ("", "."):
+            return name
+        return os.path.join(self.directory, name)
+
+    def diff(self, names=None):
+        """Compare the directory with the store without parsing anything.
+        names limits the comparison to these file names (e.g. reported by a FolderWatcher).
+
+        Returns (changed, removed): a dict filename -> signature of new or modified
+        files and a list of files that are gone.
+        """
+        if names is None:
+            current = self.scan()
+            known = self.signatures
+        else:
+            files = [self.filename_for(name) for name in names]
+            current = {f: file_signature(f) for f in files}
+            current = {f: sig for f, sig in current.items() if sig is not None}
+            known = [f for f in files if f in self.signatures]
+        removed = [f for f in known if f not in current and f not in self.pending]
+        changed = {f: sig for f, sig in current.items()
+                   if self.signatures.get(f) != sig and f not in self.pending}
+        return changed, removed
+
+    def refresh_file(self, gpx_file):
+        """Re-read a single file after it was written or deleted by this program.
+
+        Returns True if the store changed.
+        """
+        if gpx_file in self.pending:
+            return False
+        signature = file_signature(gpx_file)
+        if signature is None:
+            if gpx_file in self.signatures:
+                self.remove_file(gpx_file)
+                return True
+            return False
+        if self.signatures.get(gpx_file) == signature:
+            return False
+        self.load_file(gpx_file, signature)
+        return True
+
+    def load_file(self, gpx_file, signature):
+        """Parse a file and remember it with its signature"""
+        self.store_file(gpx_file, signature, *read_gpx_file_checked(gpx_file))
+
+    def store_file(self, gpx_file, signature, waypoints, check=None):
+        """Remember already parsed waypoints of a file.
+        check (see read_gpx_file_checked) lets the index cache keep them for the next start."""
+        for waypoint in self.waypoints.get(gpx_file, []):
+            self.grid.remove(waypoint)
+            self.clusters.remove(waypoint)
+            if self.search_index is not None:
+                self.search_index.remove(waypoint)
+        self.signatures[gpx_file] = signature
+        self.waypoints[gpx_file] = waypoints
+        self.set_check(gpx_file, check)
+        for waypoint in waypoints:
+            self.grid.add(waypoint)
+            self.clusters.add(waypoint)
+            if self.search_index is not None:
+                self.search_index.add(waypoint)
+
+    def set_check(self, gpx_file, check):
+        if check is None:
+            self.checks.pop(gpx_file, None)
+        else:
+            self.checks[gpx_file] = check
+        self.index_outdated = True
+
+    def remove_file(self, gpx_file):
+        self.signatures.pop(gpx_file, None)
+        self.set_check(gpx_file, None)
+        for waypoint in self.waypoints.pop(gpx_file, []):
+            self.grid.remove(waypoint)
+            self.clusters.remove(waypoint)
+            if self.search_index is not None:
+                self.search_index.remove(waypoint)
+
+    def get(self, waypoint_id):
+        """Waypoint for an id (filename, index), or None if it is no longer there"""
+        filename, index = waypoint_id
+        waypoints = self.waypoints.get(filename, [])
+        return waypoints[index] if index < len(waypoints) else None
+
+    def waypoints_in(self, bounds):
+        """All waypoints inside bounds = (south, west, north, east)"""
+        return self.grid.query(bounds)
+
+    def all_waypoints(self):
+        for waypoints in self.waypoints.values():
+            yield from waypoints
+
+    def search(self, query, limit=50):
+        """Waypoints matching query (see WaypointSearch); the index is built on the first call
+        and from then on kept up to date with every change of the store"""
+        if self.search_index is None:
+            with instrumentation.timer("build_search"):
+                self.search_index = WaypointSearch(self.all_waypoints())
+        with instrumentation.timer("search"):
+            return self.search_index.search(query, limit)
+
+    def restore(self, cache):
+        """Warm start: take over the waypoints of all files the index cache still
+        holds unchanged, with a single scan of the directory.
+
+        Returns (changed, removed) like diff(): the files that still have to be parsed.
+        """
+        outdated = False  # the cache holds files that are gone or changed
+        with instrumentation.timer("restore_index"):
+            current = self.scan()
+            for name, (cached_check, records) in cache.read().items():
+                gpx_file = self.filename_for(name)
+                signature = current.get(gpx_file)
+                if signature is None or gpx_file in self.signatures or gpx_file in self.pending:
+                    outdated = True
+                    continue
+                check = cache.validate(gpx_file, signature, cached_check)
+                if check != cached_check:
+                    outdated = True
+                if check is None:
+                    continue
+                waypoints = [Waypoint(gpx_file, index, *record) for index, record in enumerate(records)]
+                self.store_file(gpx_file, check[:2], waypoints, check)
+        self.index_outdated = outdated
+        changed = {f: sig for f, sig in current.items()
+                   if self.signatures.get(f) != sig and f not in self.pending}
+        removed = [f for f in self.signatures if f not in current and f not in self.pending]
+        return changed, removed
+
+class WaypointDatabase(WaypointStore):
+    """Waypoint store kept in a SQLite database instead of the GPX files of a folder.
+
+    The database is the source of truth: saving, moving and deleting change only
+    the database, GPX files of the folder are imported (again when they changed
+    since their import) and BaseCamp gets its data through export_gpx(). Viewport
+    queries go through an R*Tree index on the coordinates. The records are also
+    kept in memory, so markers and clusters work exactly as with the file store.
+    "filename" stays the grouping of the waypoints: the file they were imported
+    from or the file name a new waypoint got.
+    """
+    database = True
+
+    def __init__(self, path, directory=".", cluster_max_zoom=0):
+        super().__init__(directory, cluster_max_zoom)
+        self.grid = None  # replaced by the R*Tree
+        self.rowids = {}  # Waypoint -> rowid
+        self.by_rowid = {}  # rowid -> Waypoint
+        import sqlite3  # only needed with a database, so not imported at start
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS waypoints (
+                                   id INTEGER PRIMARY KEY, filename TEXT NOT NULL, idx INTEGER NOT NULL,
+                                   lat REAL NOT NULL, lon REAL NOT NULL, name TEXT, symbol TEXT,
+                                   descr TEXT, links TEXT, time TEXT)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS waypoints_file ON waypoints (filename, idx)")
+            self.db.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS waypoints_rtree
+                                   USING rtree(id, min_lat, max_lat, min_lon, max_lon)""")
+            # Signature of every imported GPX file at its import (NULL for files created in the database)
+            self.db.execute("""CREATE TABLE IF NOT EXISTS files (
+                                   filename TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER)""")
+        self.load()
+
+    def load(self):
+        """Read all records and file signatures into memory"""
+        for filename, mtime_ns, size in self.db.execute("SELECT filename, mtime_ns, size FROM files"):
+            self.signatures[filename] = (mtime_ns, size) if mtime_ns is not None else None
+            self.waypoints[filename] = []
+        for row in self.db.execute("""SELECT id, filename, idx, lat, lon, name, symbol, descr, links, time
+                                      FROM waypoints ORDER BY filename, idx"""):
+            waypoint = self.waypoint_from_row(row)
+            self.waypoints.setdefault(waypoint.filename, []).append(waypoint)
+            self.rowids[waypoint] = row[0]
+            self.by_rowid[row[0]] = waypoint
+            self.clusters.add(waypoint)
+
+    @staticmethod
+    def waypoint_from_row(row):
+        rowid, filename, index, lat, lon, name, symbol, desc, links, creation_time = row
+        return Waypoint(filename, index, lat, lon, name, symbol, desc or "",
+                        tuple(links.split("\n")) if links else (), creation_time)
+
+    def diff(self, names=None):
+        """GPX files of the folder that are new or changed since their import.
+        Files that vanished from the folder stay in the database."""
+        changed, removed = super().diff(names)
+        return changed, []
+
+    def refresh_file(self, gpx_file):
+        # Nothing to re-read: every change was already written to the database
+        return False
+
+    def store_file(self, gpx_file, signature, waypoints, check=None):
+        """Replace the records of a file in the database and in memory (check is not needed here)"""
+        with self.db:
+            self.db.execute("DELETE FROM waypoints_rtree WHERE id IN (SELECT id FROM waypoints WHERE filename = ?)",
+                            (gpx_file,))
+            self.db.execute("DELETE FROM waypoints WHERE filename = ?", (gpx_file,))
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                            (gpx_file, *(signature or (None, None))))
+            first_id = self.db.execute("SELECT coalesce(max(id), 0) + 1 FROM waypoints").fetchone()[0]
+            rowids = range(first_id, first_id + len(waypoints))
+            self.db.executemany(
+                "INSERT INTO waypoints (id, filename, idx, lat, lon, name, symbol, descr, links, time)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(rowid, gpx_file, w.index, w.lat, w.lon, w.name, w.symbol, w.desc, "\n".join(w.links), w.time)
+                 for rowid, w in zip(rowids, waypoints)])
+            self.db.executemany("INSERT INTO waypoints_rtree VALUES (?, ?, ?, ?, ?)",
+                                [(rowid, w.lat, w.lat, w.lon, w.lon) for rowid, w in zip(rowids, waypoints)])
+        self.forget(gpx_file)
+        self.signatures[gpx_file] = signature
+        self.waypoints[gpx_file] = waypoints
+        for rowid, waypoint in zip(rowids, waypoints):
+            self.rowids[waypoint] = rowid
+            self.by_rowid[rowid] = waypoint
+            self.clusters.add(waypoint)
+            if self.search_index is not None:
+                self.search_index.add(waypoint)
+
+    def remove_file(self, gpx_file):
+        """Delete the records of a file. An imported file keeps its signature,
+        so it is not imported again as long as it does not change."""
+        signature = self.signatures.get(gpx_file)
+        if signature is not None:
+            self.store_file(gpx_file, signature, [])
+            return
+        with self.db:
+            self.db.execute("DELETE FROM waypoints_rtree WHERE id IN (SELECT id FROM waypoints WHERE filename = ?)",
+                            (gpx_file,))
+            self.db.execute("DELETE FROM waypoints WHERE filename = ?", (gpx_file,))
+            self.db.execute("DELETE FROM files WHERE filename = ?", (gpx_file,))
+        self.forget(gpx_file)
+        self.signatures.pop(gpx_file, None)
+        self.waypoints.pop(gpx_file, None)
+
+    def forget(self, gpx_file):
+        """Drop the in-memory records of a file"""
+        for waypoint in self.waypoints.get(gpx_file, []):
+            self.by_rowid.pop(self.rowids.pop(waypoint, None), None)
+            self.clusters.remove(waypoint)
+            if self.search_index is not None:
+                self.search_index.remove(waypoint)
+
+    def waypoints_in(self, bounds):
+        """All waypoints inside bounds = (south, west, north, east), found through the R*Tree"""
+        south, west, north, east = bounds
+        for (rowid,) in self.db.execute("""SELECT id FROM waypoints_rtree WHERE
+                                           max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?""",
+                                        (south, north, west, east)):
+            waypoint = self.by_rowid.get(rowid)
+            # The R*Tree stores 32 bit floats, the exact check is done here
+            if waypoint is not None and south <= waypoint.lat <= north and west <= waypoint.lon <= east:
+                yield waypoint
+
+    def import_gpx(self, gpx_files):
+        """Import GPX files (again); returns the number of imported waypoints"""
+        count = 0
+        for gpx_file in gpx_files:
+            waypoints = read_gpx_file(gpx_file)
+            self.store_file(gpx_file, file_signature(gpx_file), waypoints)
+            count += len(waypoints)
+        return count
+
+    def export_gpx(self, filename, bounds=None):
+        """Write all waypoints (or those inside bounds) into one GPX file for BaseCamp.
+        The rows are streamed from the database into the file."""
+        if bounds is None:
+            rows = self.db.execute("""SELECT id, filename, idx, lat, lon, name, symbol, descr, links, time
+                                      FROM waypoints ORDER BY filename, idx""")
+        else:
+            south, west, north, east = bounds
+            rows = self.db.execute("""SELECT w.id, w.filename, w.idx, w.lat, w.lon, w.name, w.symbol, w.descr, w.links, w.time
+                                      FROM waypoints w JOIN waypoints_rtree r ON r.id = w.id
+                                      WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+                                        AND w.lat BETWEEN ? AND ? AND w.lon BETWEEN ? AND ?
+                                      ORDER BY w.filename, w.idx""",
+                                   (south, north, west, east, south, north, west, east))
+        count = 0
+        def waypoints():
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield self.waypoint_from_row(row)
+        atomic_write_gpx(filename, waypoints())
+        return count
+
+    def close(self):
+        self.db.close()
+
+class WaypointIndexCache:
+    """The parsed waypoints of a folder in one file, so a start only parses the GPX
+    files that changed since the last run.
+
+    Every file is kept with (mtime_ns, size, digest, checked_ns) of the bytes that
+    were parsed. A file whose mtime and size are unchanged is taken over as it is,
+    unless its mtime was less than RACY_WINDOW before checked_ns: another program may
+    have written it again within the same mtime tick (2 s on FAT, SMB), so such a
+    file and files that only got a new mtime (copied, touched) are read and compared
+    by digest. Files written by this program are parsed again on the next start.
+
+    The file is marshal data behind a header with a digest of the data; an outdated,
+    foreign or damaged cache is ignored and all files are parsed.
+    """
+    FILENAME = ".garmin_waypoint_index"
+    MAGIC = b"GWCINDEX"
+    VERSION = 1
+    RACY_WINDOW = 2_000_000_000  # ns
+
+    def __init__(self, directory="."):
+        self.path = os.path.join(directory, self.FILENAME)
+
+    def read(self):
+        """name -> (check, records) of the cached files, {} if there is no usable cache"""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return {}
+        magic, digest, data = data[:len(self.MAGIC)], data[len(self.MAGIC):len(self.MAGIC) + 16], data[len(self.MAGIC) + 16:]
+        if magic != self.MAGIC or hashlib.blake2b(data, digest_size=16).digest() != digest:
+            return {}
+        try:
+            version, files = marshal.loads(data)
+            if version != self.VERSION:
+                return {}
+            return {name: (check, records) for name, check, records in files}
+        except (EOFError, ValueError, TypeError):
+            return {}
+
+    def validate(self, gpx_file, signature, check):
+        """check of the file if its cached waypoints still hold, None if it has to be parsed"""
+        mtime_ns, size, digest, checked_ns = check
+        if signature == (mtime_ns, size) and mtime_ns < checked_ns - self.RACY_WINDOW:
+            return check
+        if signature[1] != size:
+            return None
+        current = file_check(gpx_file)
+        if current is None or current[2] != digest:
+            return None
+        return current
+
+    def write(self, store):
+        """Write the files of the store that came from a parse (not the ones saved by the program)"""
+        with instrumentation.timer("write_index"):
+            files = []
+            for gpx_file, check in store.checks.items():
+                if gpx_file in store.pending:
+                    continue
+                records = [(w.lat, w.lon, w.name, w.symbol, w.desc, w.links, w.time) for w in store.waypoints[gpx_file]]
+                files.append((os.path.basename(gpx_file), check, records))
+            data = marshal.dumps((self.VERSION, files))
+            atomic_write_bytes(self.path, [self.MAGIC, hashlib.blake2b(data, digest_size=16).digest(), data])
+        store.index_outdated = False
+
+class WaypointLoader:
+    """Parses GPX files on a worker pool and hands the results back to the Tk thread.
+
+    Workers put (generation, filename, signature, waypoints, check) tuples into a queue
+    which the UI polls with after(). Starting a new load or calling cancel() bumps
+    the generation, so workers of an older load stop early and their results are
+    dropped. A thread pool is used because the results are plain Python objects
+    that would otherwise have to be pickled between processes, and because it
+    works unchanged in the PyInstaller bundle.
+    """
+    CHUNK_SIZE = 32  # files per worker job
+
+    def __init__(self, max_workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 1),
+                                           thread_name_prefix="gpx-loader")
+        self.results = queue.Queue()
+        self.generation = 0
+        self.pending = 0
+
+    def start(self, jobs):
+        """Start parsing the given {filename: signature} jobs, cancelling a running load"""
+        self.cancel()
+        generation = self.generation
+        jobs = list(jobs.items())
+        self.pending = len(jobs)
+        for i in range(0, len(jobs), self.CHUNK_SIZE):
+            self.executor.submit(self.parse_chunk, generation, jobs[i:i + self.CHUNK_SIZE])
+
+    def parse_chunk(self, generation, jobs):
+        for gpx_file, signature in jobs:
+            if generation != self.generation:
+                return
+            self.results.put((generation, gpx_file, signature, *read_gpx_file_checked(gpx_file)))
+
+    def cancel(self):
+        self.generation += 1
+        self.pending = 0
+        try:
+            while True:
+                self.results.get_nowait()
+        except queue.Empty:
+            pass
+
+    def get_results(self, time_budget=0.03):
+        """Collect finished results of the current load, spending at most time_budget seconds"""
+        results = []
+        deadline = time.perf_counter() + time_budget
+        while self.pending and time.perf_counter() < deadline:
+            try:
+                generation, gpx_file, signature, waypoints, check = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self.generation:
+                continue
+            self.pending -= 1
+            results.append((gpx_file, signature, waypoints, check))
+        return results
+
+    @property
+    def busy(self):
+        return self.pending > 0
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class FolderWatcher:
+    """Reports GPX files of a folder that other programs created, changed or deleted.
+
+    On Linux inotify is used (through ctypes, no extra package is needed); elsewhere,
+    or if inotify is not available, the folder is polled every POLL_INTERVAL seconds.
+    The events are collected by a background thread. take() returns the names of the
+    files that changed since the last call, or None if the whole folder has to be
+    compared (after an inotify queue overflow); ready() tells when a burst of events
+    is over, so it can be applied in one go.
+    """
+    POLL_INTERVAL = 2.0
+
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct("iIII")  # struct inotify_event without the name
+
+    def __init__(self, directory="."):
+        self.directory = directory
+        self.method = None  # "inotify" or "poll"
+        self.lock = threading.Lock()
+        self.names = set()
+        self.everything = False
+        self.first_event = None
+        self.last_event = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        fd = self.open_inotify()
+        if fd is not None:
+            self.method = "inotify"
+            target, args = self.run_inotify, (fd,)
+        else:
+            self.method = "poll"
+            target, args = self.run_polling, (scan_gpx_folder(self.directory),)
+        self.thread = threading.Thread(target=target, args=args, name="folder-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def open_inotify(self):
+        """inotify file descriptor watching the folder, or None"""
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_DELETE
+        if libc.inotify_add_watch(fd, os.fsencode(os.path.abspath(self.directory)), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def run_inotify(self, fd):
+        try:
+            while not self.stopped.is_set():
+                ready, _, _ = select.select([fd], [], [], 0.5)
+                if not ready:
+                    continue
+                try:
+                    data = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                offset = 0
+                while offset + self.EVENT_HEADER.size <= len(data):
+                    _, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+                    offset += self.EVENT_HEADER.size
+                    name = data[offset:offset + length].split(b"\0", 1)[0]
+                    offset += length
+                    if mask & self.IN_Q_OVERFLOW:
+                        self.report(None)
+                    elif name:
+                        self.report(os.fsdecode(name))
+        finally:
+            os.close(fd)
+
+    def run_polling(self, snapshot):
+        while not self.stopped.wait(self.POLL_INTERVAL):
+            try:
+                current = scan_gpx_folder(self.directory)
+            except OSError:
+                continue
+            for name in snapshot.keys() | current.keys():
+                if snapshot.get(name) != current.get(name):
+                    self.report(name)
+            snapshot = current
+
+    def report(self, name):
+        """Remember a changed file (None: compare the whole folder)"""
+        if name is not None and not is_gpx_name(name):
+            return
+        now = time.monotonic()
+        with self.lock:
+            if name is None:
+                self.everything = True
+            else:
+                self.names.add(name)
+            if self.first_event is None:
+                self.first_event = now
+            self.last_event = now
+
+    def ready(self, quiet, max_delay):
+        """True if events are waiting and none came for quiet seconds
+        (or the first one is older than max_delay seconds)"""
+        with self.lock:
+            if self.first_event is None:
+                return False
+            now = time.monotonic()
+            return now - self.last_event >= quiet or now - self.first_event >= max_delay
+
+    def take(self):
+        with self.lock:
+            names = None if self.everything else self.names
+            self.names = set()
+            self.everything = False
+            self.first_event = self.last_event = None
+        return names
+
+# ------------------------------------------------------------------------------------------
+# GPX writer
+# ------------------------------------------------------------------------------------------
+
+GPXX_NAMESPACE = "http://www.garmin.com/xmlschemas/GpxExtensions/v3"
+
+GPX_ROOT_ATTRIBUTES = (
+    ('xmlns', 'http://www.topografix.com/GPX/1/1'),
+    ('xmlns:xsi', 'http://www.w3.org/2001/XMLSchema-instance'),
+    ('xmlns:gpxx', GPXX_NAMESPACE),
+    ('xmlns:ctx', 'http://www.garmin.com/xmlschemas/CreationTimeExtension/v1'),
+    ('version', '1.1'),
+    ('creator', 'Garmin Waypoint Creator'),
+    ('xsi:schemaLocation', 'http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd http://www.garmin.com/xmlschemas/GpxExtensions/v3 http://www.garmin.com/xmlschemas/GpxExtensionsv3.xsd http://www.garmin.com/xmlschemas/CreationTimeExtension/v1 http://www.garmin.com/xmlschemas/CreationTimeExtensionv1.xsd'),
+)
+
+def xml_escape(data):
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+def xml_text(data):
+    """Escaped element text; line ends are normalised like an XML parser does.
+    None (an empty element such as <name/> when read) is written as empty text."""
+    if not data:
+        return ""
+    return xml_escape(data.replace("\r\n", "\n").replace("\r", "\n"))
+
+def build_description(name, text, links):
+    """HTML description of a waypoint: title, the user's text and the links"""
+    desc = f"<h2>{name}</h2>\n"
+    if text:
+        desc += text + "\n"
+    for link in links:
+        desc += f'<p><a href="{link}" target="_blank">{link}</a></p>\n'
+    return desc
+
+def description_text(desc):
+    """The user's text of a description made by build_description (title and links removed)"""
+    # Simple HTML to text conversion
+    # Remove HTML tags but keep content
+    desc = re.sub(r'<h2>.*?</h2>', '', desc)
+    desc = re.sub(r'<p><a.*?>(.*?)</a></p>', '', desc)  # Remove links from description
+    return desc.strip()
+
+def creation_time_now():
+    return datetime.utcnow().isoformat() + 'Z'
+
+def random_filename():
+    """File name for a new single-waypoint file"""
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=8)) + '.gpx'
+
+class GpxWriter:
+    """Writes Garmin GPX waypoints straight to a text file handle, one <wpt> at a time.
+
+    Memory use does not depend on the number of waypoints. The output is byte for
+    byte what the earlier ElementTree -> minidom pretty printing produced, which
+    BaseCamp and the Garmin devices are known to accept.
+
+        with GpxWriter(f) as writer:
+            for waypoint in waypoints:
+                writer.write_waypoint(waypoint)
+    """
+    def __init__(self, f):
+        self.f = f
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.end()
+
+    def start(self):
+        attributes = " ".join(f'{key}="{xml_escape(value)}"' for key, value in GPX_ROOT_ATTRIBUTES)
+        self.f.write(f'<?xml version="1.0" ?>\n<gpx {attributes}>\n')
+
+    def write_waypoint(self, waypoint):
+        """Write one waypoint; its desc is written as is (see build_description)"""
+        parts = [
+            f'  <wpt lat="{xml_escape(str(waypoint.lat))}" lon="{xml_escape(str(waypoint.lon))}">\n',
+            f'    <name>{xml_text(waypoint.name)}</name>\n',
+            f'    <desc>{xml_text(waypoint.desc)}</desc>\n',
+        ]
+        for link in waypoint.links:
+            parts.append(f'    <link href="{xml_escape(link)}"/>\n')
+        parts.append(f'    <sym>{xml_text(waypoint.symbol)}</sym>\n')
+        parts.append('    <extensions>\n'
+                     '      <gpxx:WaypointExtension>\n'
+                     '        <gpxx:DisplayMode>SymbolAndName</gpxx:DisplayMode>\n'
+                     '      </gpxx:WaypointExtension>\n'
+                     '      <ctx:CreationTimeExtension xmlns:ctx="http://www.garmin.com/xmlschemas/CreationTimeExtension/v1">\n'
+                     f'        <ctx:CreationTime>{xml_text(waypoint.time or creation_time_now())}</ctx:CreationTime>\n'
+                     '      </ctx:CreationTimeExtension>\n'
+                     '    </extensions>\n'
+                     '  </wpt>\n')
+        self.f.write("".join(parts))
+
+    def end(self):
+        self.f.write('</gpx>\n')
+
+# ------------------------------------------------------------------------------------------
+# Saving
+# ------------------------------------------------------------------------------------------
+
+def fsync_directory(directory):
+    """Make a rename in directory durable (not possible and not needed on Windows)"""
+    if sys.platform == "win32":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write_bytes(filename, chunks):
+    """Write a file so that after a crash it is either completely old or completely new.
+    The data goes to a hidden temporary file in the same folder, is synced to disk and
+    then renamed over the target."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    try:
+        mode = os.stat(filename).st_mode & 0o777
+    except OSError:
+        mode = 0o644
+    import tempfile
+    fd, temp_path = tempfile.mkstemp(prefix="." + os.path.basename(filename) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, filename)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    fsync_directory(directory)
+
+def encode_gpx(text):
+    """Bytes of GPX text with the platform's line ends, as a file opened with 'w' would get"""
+    if os.linesep != "\n":
+        text = text.replace("\n", os.linesep)
+    return text.encode('utf-8')
+
+@instrumentation.timed("write_gpx")
+def atomic_write_gpx(filename, waypoints):
+    """Write waypoints crash-safe into a GPX file (see atomic_write_bytes)"""
+    def chunks():
+        content = io.StringIO()
+        writer = GpxWriter(content)
+        writer.start()
+        for waypoint in waypoints:
+            writer.write_waypoint(waypoint)
+            if content.tell() > 1 << 16:
+                yield encode_gpx(content.getvalue())
+                content.seek(0)
+                content.truncate()
+        writer.end()
+        yield encode_gpx(content.getvalue())
+    atomic_write_bytes(filename, chunks())
+
+class GpxCollection:
+    """A GPX file holding many waypoints that is changed one <wpt> at a time.
+
+    An offset index holds the byte range of every <wpt> element. It is built by a
+    plain byte scan (no XML parsing) and kept up to date after every write, together
+    with a digest of the bytes it describes. Before a change the file is compared
+    with that digest; a file changed by another program (even with the same size and
+    mtime) is scanned again, so the offsets always fit the bytes they are used on. Changes
+    are applied by splicing: the untouched parts of the file are copied byte for
+    byte, only the changed <wpt> elements are serialised, and the result replaces
+    the file atomically. Collections are sharded (COLLECTION_SHARD_SIZE waypoints per
+    file), which keeps that copy small. Only the save queue thread uses it.
+
+    Files of other programs are only changed where it is safe: a file with other
+    content (comments, routes) between its <wpt> elements or one that does not
+    match the expected waypoints is refused, never rewritten from the records.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.digest = None   # digest of the bytes the index was built from
+        self.newline = b"\n"
+        self.header = None   # (start, end) before the first <wpt>
+        self.offsets = []    # (start, end) of every <wpt>, whole lines
+        self.footer = None   # (start, end) after the last <wpt>
+        self.gpxx_declared = True  # the root element declares the gpxx: prefix
+
+    @staticmethod
+    def digest_of(data):
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def scan(self, data=None):
+        """Build the offset index from the file on disk (or from data, its current bytes)"""
+        if data is None:
+            with open(self.filename, 'rb') as f:
+                data = f.read()
+        self.newline = b"\r\n" if b"\r\n" in data[:4096] else b"\n"
+        offsets = []
+        pos = 0
+        while True:
+            start = data.find(b"<wpt", pos)
+            if start < 0:
+                break
+            if data[start + 4:start + 5] not in (b" ", b"\t", b"\r", b"\n", b">", b"/"):
+                pos = start + 4
+                continue
+            tag_end = data.find(b">", start)
+            if tag_end < 0:
+                raise ValueError(f"{self.filename}: unterminated <wpt>")
+            if data[tag_end - 1:tag_end] == b"/":
+                end = tag_end + 1
+            else:
+                end = data.find(b"</wpt>", tag_end)
+                if end < 0:
+                    raise ValueError(f"{self.filename}: <wpt> without </wpt>")
+                end += len(b"</wpt>")
+            # Extend to whole lines, so indentation and line end belong to the element
+            line_start = data.rfind(b"\n", 0, start) + 1
+            if not data[line_start:start].strip():
+                start = line_start
+            line_end = data.find(b"\n", end)
+            if line_end >= 0 and not data[end:line_end].strip():
+                end = line_end + 1
+            if offsets and data[offsets[-1][1]:start].strip():
+                raise ValueError(f"{self.filename}: other content between the <wpt> elements")
+            offsets.append((start, end))
+            pos = end
+        
+        if offsets:
+            body_start, body_end = offsets[0][0], offsets[-1][1]
+        else:
+            # Empty collection: new waypoints go in front of the </gpx> line
+            body_start = data.rfind(b"</gpx>")
+            if body_start < 0:
+                raise ValueError(f"{self.filename}: no </gpx>")
+            body_start = body_end = data.rfind(b"\n", 0, body_start) + 1
+        root_start = data.find(b"<gpx", 0, body_start)
+        root_end = data.find(b">", root_start, body_start)
+        self.gpxx_declared = root_start >= 0 and b"xmlns:gpxx=" in data[root_start:root_end]
+        self.header = (0, body_start)
+        self.offsets = offsets
+        self.footer = (body_end, len(data))
+        self.digest = self.digest_of(data)
+
+    def encode_waypoint(self, waypoint):
+        content = io.StringIO()
+        GpxWriter(content).write_waypoint(waypoint)
+        data = content.getvalue()
+        if not self.gpxx_declared:
+            # A foreign file: declare the prefix on the element, or it would be unbound
+            data = data.replace("<gpxx:WaypointExtension>",
+                                f'<gpxx:WaypointExtension xmlns:gpxx="{GPXX_NAMESPACE}">', 1)
+        return data.encode('utf-8').replace(b"\n", self.newline)
+
+    @instrumentation.timed("splice_gpx")
+    def apply(self, changes, waypoints):
+        """Apply ("put", index, waypoint) and ("delete", index) changes in one write.
+        waypoints is the expected result. If the file does not match it (e.g. it was
+        changed by another program in an unexpected way) nothing is written and
+        ValueError is raised; the save queue reports it."""
+        try:
+            if not os.path.exists(self.filename):
+                self.create()
+            # The splice copies from exactly these bytes
+            with open(self.filename, 'rb') as f:
+                data = f.read()
+            if self.digest != self.digest_of(data):
+                # Not the bytes the index was built from: changed by another program
+                self.scan(data)
+            segments = [("copy", start, end) for start, end in self.offsets]
+            for change in changes:
+                if change[0] == "put":
+                    _, index, waypoint = change
+                    segment = ("data", self.encode_waypoint(waypoint))
+                    if index < len(segments):
+                        segments[index] = segment
+                    elif index == len(segments):
+                        segments.append(segment)
+                    else:
+                        raise ValueError(f"{self.filename}: no waypoint {index}")
+                else:
+                    del segments[change[1]]
+            if len(segments) != len(waypoints):
+                raise ValueError(f"{self.filename}: {len(segments)} waypoints instead of {len(waypoints)}")
+        except ValueError:
+            # Scan again next time instead of trusting the index
+            self.digest = None
+            raise
+        self.write([("copy",) + self.header] + segments + [("copy",) + self.footer], data)
+
+    def create(self):
+        """Start an empty collection file"""
+        content = io.StringIO()
+        writer = GpxWriter(content)
+        writer.start()
+        writer.end()
+        atomic_write_bytes(self.filename, [encode_gpx(content.getvalue())])
+        self.scan()
+
+    def write(self, segments, data):
+        """Write the segments (ranges of data, the current file bytes, or new bytes) into a
+        new file that atomically replaces the old one"""
+        view = memoryview(data)
+        digest = hashlib.blake2b(digest_size=16)
+        offsets = []
+        parts = []
+        position = 0
+        for i, segment in enumerate(segments):
+            part = view[segment[1]:segment[2]] if segment[0] == "copy" else segment[1]
+            if 0 < i < len(segments) - 1:
+                offsets.append((position, position + len(part)))
+            elif i == 0:
+                header = (0, len(part))
+            else:
+                footer = (position, position + len(part))
+            position += len(part)
+            parts.append(part)
+
+        def chunks():
+            for part in parts:
+                digest.update(part)
+                yield part
+        atomic_write_bytes(self.filename, chunks())
+        
+        self.header = header
+        self.offsets = offsets
+        self.footer = footer
+        self.digest = digest.digest()
+
+class WriteFileJob:
+    """Save job: write a whole GPX file from waypoint records"""
+    def __init__(self, filename, waypoints):
+        self.filename = filename
+        self.waypoints = list(waypoints)
+
+    def merge(self, newer):
+        # Every job knows the complete new content, so the older job can be dropped
+        if isinstance(newer, WriteFileJob):
+            return newer
+        return WriteFileJob(self.filename, newer.waypoints)
+
+    def run(self):
+        atomic_write_gpx(self.filename, self.waypoints)
+
+class CollectionJob:
+    """Save job: change single waypoints of a collection file (see GpxCollection.apply)"""
+    def __init__(self, collection, changes, waypoints):
+        self.collection = collection
+        self.changes = list(changes)
+        self.waypoints = list(waypoints)
+
+    def merge(self, newer):
+        if isinstance(newer, CollectionJob):
+            return CollectionJob(self.collection, self.changes + newer.changes, newer.waypoints)
+        return newer
+
+    def run(self):
+        self.collection.apply(self.changes, self.waypoints)
+
+class SaveQueue:
+    """Write-behind queue for GPX files.
+
+    save() only records a job (WriteFileJob or CollectionJob) for a file. A
+    background thread runs it once `delay` seconds have passed; further saves of
+    the same file within that time are merged into the waiting job, so a burst of
+    saves (editing, moving, saving again) ends up as one write. Finished writes
+    are reported as (filename, signature, error) in `results`. flush() writes
+    everything that is still pending and waits for it.
+    """
+    def __init__(self, delay=0.5):
+        self.delay = delay
+        self.pending = {}   # filename -> [due, job]
+        self.writing = None
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="gpx-writer", daemon=True)
+        self.thread.start()
+
+    def save(self, filename, job):
+        with self.condition:
+            if filename in self.pending:
+                entry = self.pending[filename]
+                entry[1] = entry[1].merge(job)
+            else:
+                self.pending[filename] = [time.monotonic() + self.delay, job]
+            self.condition.notify_all()
+
+    def discard(self, filename):
+        """Drop a pending save (e.g. before the file is deleted) and wait for a running one"""
+        with self.condition:
+            self.pending.pop(filename, None)
+            while self.writing == filename:
+                self.condition.wait()
+
+    def busy(self, filename):
+        with self.condition:
+            return filename in self.pending or self.writing == filename
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.pending:
+                        filename, (due, job) = min(self.pending.items(), key=lambda item: item[1][0])
+                        wait = due - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self.condition.wait(wait)
+                    elif self.stopped:
+                        return
+                    else:
+                        self.condition.wait()
+                del self.pending[filename]
+                self.writing = filename
+            
+            error = None
+            try:
+                with instrumentation.timer("save_file"):
+                    job.run()
+                instrumentation.count("files_saved")
+            except Exception as e:
+                error = e
+            self.results.put((filename, file_signature(filename), error))
+            
+            with self.condition:
+                self.writing = None
+                self.condition.notify_all()
+
+    def flush(self):
+        """Write all pending files now and wait until they are on disk"""
+        with self.condition:
+            for entry in self.pending.values():
+                entry[0] = 0
+            self.condition.notify_all()
+            while self.pending or self.writing is not None:
+                self.condition.wait()
+
+    def close(self):
+        self.flush()
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+# ------------------------------------------------------------------------------------------
+# Duplicates
+# ------------------------------------------------------------------------------------------
+
+EARTH_RADIUS = 6371000.0  # m
+
+def distance_m(a, b):
+    """Distance of two waypoints in metres (equirectangular, exact enough for short distances)"""
+    x = math.radians((b.lon - a.lon + 540.0) % 360.0 - 180.0) * math.cos(math.radians((a.lat + b.lat) / 2))
+    y = math.radians(b.lat - a.lat)
+    return EARTH_RADIUS * math.hypot(x, y)
+
+DIGITS = re.compile(r"\d+")
+
+def similar_names(a, b, min_similarity):
+    """True if two names (as search_words joined by blanks) are at least min_similarity (0..1) alike.
+    Numbers have to be the same: "Quelle 1" and "Quelle 2" are two places.
+    A point without a name (nothing left after normalising) is like no other."""
+    if not a or not b:
+        return False
+    if a == b:
+        return True
+    if DIGITS.findall(a) != DIGITS.findall(b):
+        return False
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    return (matcher.real_quick_ratio() >= min_similarity and matcher.quick_ratio() >= min_similarity
+            and matcher.ratio() >= min_similarity)
+
+def find_duplicates(waypoints, max_distance=25.0, min_similarity=0.8):
+    """Groups of waypoints that are probably the same place saved more than once:
+    at most max_distance metres apart and with names at least min_similarity alike
+    (ignoring case, accents and punctuation). A~B and B~C make one group A, B, C.
+
+    Spatial hashing: every waypoint goes into a grid cell at least max_distance wide,
+    so a waypoint is only compared with the waypoints of its own and the neighbouring
+    cells, and the run time grows about linearly with the number of waypoints.
+    Within 5 degrees of the poles cells may be narrower and pairs can be missed.
+
+    Every group is sorted oldest first (creation time, then file); the first
+    waypoint is the one to keep. Waypoints without a name are never grouped.
+    """
+    waypoints = list(waypoints)
+    if not waypoints:
+        return []
+    cell_lat = math.degrees(max_distance / EARTH_RADIUS)
+    cell_lon = cell_lat / math.cos(math.radians(min(max(abs(w.lat) for w in waypoints), 85.0)))
+    cells = {}  # (row, column) -> [Waypoint, ...]
+    for waypoint in waypoints:
+        cells.setdefault((math.floor(waypoint.lat / cell_lat), math.floor(waypoint.lon / cell_lon)), []).append(waypoint)
+
+    names = {}  # Waypoint -> normalised name
+    parents = {}  # union-find over the waypoints with a duplicate
+
+    def name_of(waypoint):
+        name = names.get(waypoint)
+        if name is None:
+            name = names[waypoint] = " ".join(search_words(waypoint.name or ""))
+        return name
+
+    def root(waypoint):
+        while parents.get(waypoint, waypoint) is not waypoint:
+            parents[waypoint] = parents.get(parents[waypoint], parents[waypoint])
+            waypoint = parents[waypoint]
+        return waypoint
+
+    for (row, column), members in cells.items():
+        # The own cell and the four neighbours not yet visited from the other side
+        for d_row, d_column in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+            others = cells.get((row + d_row, column + d_column))
+            if not others:
+                continue
+            for i, a in enumerate(members):
+                for b in (others[i + 1:] if others is members else others):
+                    if distance_m(a, b) <= max_distance and similar_names(name_of(a), name_of(b), min_similarity):
+                        root_a, root_b = root(a), root(b)
+                        if root_a is not root_b:
+                            parents[root_a] = root_b
+                            parents.setdefault(root_b, root_b)
+
+    groups = {}
+    for waypoint in parents:
+        groups.setdefault(root(waypoint), []).append(waypoint)
+    result = [sorted(group, key=lambda w: (w.time is None, w.time or "", w.filename or "", w.index))
+              for group in groups.values()]
+    result.sort(key=lambda group: ((group[0].name or "").casefold(), group[0].filename or ""))
+    return result
+
+def merge_waypoints(waypoints):
+    """One waypoint out of duplicates: the first one, with the longest text and the links of all"""
+    first = waypoints[0]
+    text = max((description_text(w.desc or "") for w in waypoints), key=len)
+    links = tuple(dict.fromkeys(link for w in waypoints for link in w.links))
+    return Waypoint(first.filename, first.index, first.lat, first.lon, first.name, first.symbol,
+                    build_description(first.name or "", text, links), links, first.time)
+
+# ------------------------------------------------------------------------------------------
+# Garmin symbols
+# ------------------------------------------------------------------------------------------
+
+# Icon name in the selection -> <sym> value written to the GPX file
+GARMIN_ICONS = {
+    "Campground": "Campground",
+    "RV Park": "RV Park",
+    "Scenic Area": "Scenic Area",
+    "Museum": "Museum",
+    "Church": "Church",
+    "Information": "Information",
+    "Parking Area": "Parking Area",
+    "Restaurant": "Restaurant",
+    "Winery": "Winery",
+    "Hotel": "Hotel",
+    "Lodge": "Lodge",
+    "Funicular": "Funicular",
+    "Gas Station": "Gas Station",
+    "Bar": "Bar",
+    "Library": "Library",
+    "Theater": "Theater",
+    "Swimming Area": "Swimming Area",
+    "Waypoint": "Waypoint",
+    "Summit": "Summit",
+    "Geocache": "Geocache",
+    "Car": "Car",
+    "Flag": "Flag",
+    "Truck Stop": "Truck Stop",
+    "Airport": "Airport",
+    "Shopping": "Shopping",
+    "School": "School",
+    "Cemetery": "Cemetery",
+    "Park": "Park",
+    "Picnic Area": "Picnic Area",
+    "Restroom": "Restroom",
+    "Telephone": "Telephone",
+    "Medical Facility": "Medical Facility",
+    "Pharmacy": "Pharmacy",
+    "Police Station": "Police Station",
+    "Fire Department": "Fire Department",
+    "Bank": "Bank",
+    "Fast Food": "Fast Food",
+    "Pizza": "Pizza",
+    "Stadium": "Stadium",
+    "Golf Course": "Golf Course",
+    "Skiing Area": "Skiing Area",
+    "Dam": "Dam",
+    "Controlled Area": "Controlled Area",
+    "Danger Area": "Danger Area",
+    "Restricted Area": "Restricted Area",
+    "Null": "Null",
+    "Ball Park": "Ball Park",
+    "Car Rental": "Car Rental",
+    "City (Capitol)": "City (Capitol)",
+    "City (Large)": "City (Large)",
+    "City (Medium)": "City (Medium)",
+    "City (Small)": "City (Small)",
+    "Civil": "Civil",
+    "Coast Guard": "Coast Guard",
+    "Contact, Afro": "Contact, Afro",
+    "Contact, Alien": "Contact, Alien",
+    "Contact, Ball Cap": "Contact, Ball Cap",
+    "Contact, Big Ears": "Contact, Big Ears",
+    "Contact, Biker": "Contact, Biker",
+    "Contact, Bug": "Contact, Bug",
+    "Contact, Cat": "Contact, Cat",
+    "Contact, Dog": "Contact, Dog",
+    "Contact, Dreadlocks": "Contact, Dreadlocks",
+    "Contact, Female1": "Contact, Female1",
+    "Contact, Female2": "Contact, Female2",
+    "Contact, Female3": "Contact, Female3",
+    "Contact, Goatee": "Contact, Goatee",
+    "Contact, Kung-Fu": "Contact, Kung-Fu",
+    "Contact, Pirate": "Contact, Pirate",
+    "Contact, Ranger": "Contact, Ranger",
+    "Contact, Smiley": "Contact, Smiley",
+    "Contact, Spike": "Contact, Spike",
+    "Contact, Sumo": "Contact, Sumo"
+}
+
+class SymbolRegistry:
+    """All known Garmin symbols, built once at startup.
+
+    Maps in both directions between the name shown in the icon selection (which is
+    also the PNG name in icons_garmin) and the <sym> value written to the GPX file.
+    Lookups are case-insensitive and also accept aliases such as the ".png" suffix
+    earlier versions wrote for "Funicular".
+    """
+    ALIASES = {
+        "Funicular.png": "Funicular",
+    }
+
+    def __init__(self, icons_dir, garmin_icons):
+        self.icon_paths = {}   # icon key -> PNG path
+        self.symbols = {}      # icon key -> <sym> value
+        self.keys = {}         # casefolded <sym>, key or alias -> icon key
+
+        for key, symbol in garmin_icons.items():
+            self.add(key, symbol)
+
+        if os.path.isdir(icons_dir):
+            for filename in sorted(os.listdir(icons_dir), key=str.casefold):
+                # Only PNGs are icons (this also skips the Thumbs.db that Windows leaves in the folder)
+                if not filename.lower().endswith('.png'):
+                    continue
+                key = filename[:-4]
+                if key.casefold() not in self.keys:
+                    self.add(key, key)
+                self.icon_paths[self.keys[key.casefold()]] = os.path.join(icons_dir, filename)
+
+        for alias, symbol in self.ALIASES.items():
+            key = self.keys.get(symbol.casefold())
+            if key is not None:
+                self.keys.setdefault(alias.casefold(), key)
+
+    def add(self, key, symbol):
+        self.symbols[key] = symbol
+        self.keys.setdefault(key.casefold(), key)
+        self.keys.setdefault(symbol.casefold(), key)
+
+    def key_for(self, symbol):
+        """Icon key of a <sym> value (or None if unknown)"""
+        if not symbol:
+            return None
+        return self.keys.get(symbol.strip().casefold())
+
+    def symbol_for(self, key):
+        """<sym> value to write for an icon key"""
+        return self.symbols.get(key, key)
+
+    def icon_path(self, key):
+        return self.icon_paths.get(key)
+
+    def names(self):
+        """Icon keys for the selection: the common ones first, then all others"""
+        return list(self.symbols)
@@ -11,6 +11,28 @@
 #   2025 08 03      Started. Claude.ai as a support.
 #   2025 08 17      Added waypoint move functionality.
 #                   Edit Function improved.              
+#   2026 10 17      Waypoints are kept in memory, only changed GPX files are re-read.
+#                   GPX files are parsed in the background.
+#                   Only waypoints in the visible map area get a marker.
+#                   Nearby waypoints are clustered at low zoom levels.
+#                   All icons of icons_garmin can be selected.
+#                   Icons are loaded on first use from a cached icon atlas.
+#                   Map tiles are cached on disk, the map can be used offline.
+#                   Map tiles can be downloaded ahead of a trip.
+#                   Waypoints open for editing without reading the file again.
+#                   GPX files are written directly, without the minidom round trip.
+#                   Saving is crash-safe and happens in the background.
+#                   Optional collection mode: many waypoints per GPX file.
+#                   Optional SQLite waypoint database with GPX import and export.
+#                   Everything without UI moved to garmin_waypoint_core (shared with the
+#                   command line tool garmin_waypoint_cli).
+#                   GPX files changed by other programs show up without a refresh.
+#                   Optional timing of the hot paths with a statistics window.
+#                   The window shows up at once; the map (garmin_waypoint_map) and PIL are
+#                   imported once it is visible.
+#                   Index cache of the parsed waypoints: a start only parses changed files.
+#                   Search box over name, text and symbol that jumps to the chosen waypoint.
+#                   Finder for waypoints saved more than once, with merge and delete.
 # 
 # ##########################################################################################
 # Version 1.5
@@ -19,20 +41,369 @@
 # ------------------------------------------------------------------------------------------
 
 import tkinter as tk
-from tkinter import ttk, messagebox
-import tkintermapview
-from datetime import datetime
-import xml.etree.ElementTree as ET
-import xml.dom.minidom
-import random
-import string
+from tkinter import ttk, messagebox, filedialog
 import os
 import glob
-import requests
-from PIL import Image, ImageTk
-from io import BytesIO
+from collections import Counter, OrderedDict
 import threading
+import queue
+import time
 import sys
+import re
+import json
+import hashlib
+from datetime import datetime
+from garmin_waypoint_core import (GARMIN_ICONS, SymbolRegistry, Waypoint, WaypointStore, WaypointDatabase,
+                                  WaypointIndexCache, WaypointLoader, FolderWatcher, GpxCollection, WriteFileJob, CollectionJob, SaveQueue,
+                                  build_description, description_text, creation_time_now, random_filename, file_signature,
+                                  world_xy, world_to_latlon, find_duplicates, merge_waypoints, instrumentation)
+
+# ------------------------------------------------------------------------------------------
+# Settings
+# ------------------------------------------------------------------------------------------
+
+# Below this zoom level nearby waypoints are combined into one marker showing their number
+CLUSTER_MAX_ZOOM = 11
+
+# Icon sizes in pixels: markers on the map and the icon selection in the edit window
+MAP_ICON_SIZE = 24
+LARGE_ICON_SIZE = 32
+
+# Number of the most used icons of the loaded waypoints decoded ahead of time
+ICON_PREWARM_COUNT = 16
+
+# Map tiles; GWC_TILE_SERVER can point to another (e.g. a local) tile server
+TILE_SERVER = os.environ.get("GWC_TILE_SERVER", "https://a.tile.openstreetmap.org/{z}/{x}/{y}.png")
+TILE_CACHE_MAX_MB = 512
+# Start without network, using only cached tiles (GWC_OFFLINE=1)
+START_OFFLINE = os.environ.get("GWC_OFFLINE", "") == "1"
+
+# SQLite database (GWC_DATABASE=<path>) that holds the waypoints instead of the GPX files;
+# GPX files of the working directory are imported into it
+WAYPOINT_DATABASE = os.environ.get("GWC_DATABASE", "")
+
+# Keep the parsed waypoints in an index file next to the GPX files, so a start only parses the
+# files that changed since the last run (GWC_INDEX=0 starts without)
+WAYPOINT_INDEX = os.environ.get("GWC_INDEX", "1") != "0"
+
+# Instrumentation of the hot paths (GWC_PROFILE=1 or --profile; GWC_PROFILE=cprofile or --cprofile
+# also runs cProfile). Timings can be seen in the "Statistik" window and are written on exit.
+PROFILE = "cprofile" if "--cprofile" in sys.argv else "1" if "--profile" in sys.argv else os.environ.get("GWC_PROFILE", "")
+
+# Watch the folder for GPX files changed by other programs (GWC_WATCH=0 starts without);
+# a burst of changes is applied once no event came for WATCH_QUIET seconds (at the latest after WATCH_MAX_DELAY)
+WATCH_FOLDER = os.environ.get("GWC_WATCH", "1") != "0"
+WATCH_QUIET = 0.5
+WATCH_MAX_DELAY = 3.0
+
+# Collection mode (GWC_COLLECTION=<name>): new waypoints are added to <name>.gpx, <name>_2.gpx, ...
+# instead of one file per waypoint, with at most COLLECTION_SHARD_SIZE waypoints per file
+COLLECTION_NAME = os.environ.get("GWC_COLLECTION", "")
+COLLECTION_SHARD_SIZE = 500
+
+# Search box: at most SEARCH_LIMIT hits are listed, a chosen hit is shown at zoom SEARCH_ZOOM or closer
+SEARCH_LIMIT = 50
+SEARCH_ZOOM = 15
+
+# Duplicates: waypoints at most DUPLICATE_DISTANCE metres apart whose names are at least
+# DUPLICATE_SIMILARITY (0..1) alike; both can be changed in the "Duplikate" window
+DUPLICATE_DISTANCE = 25
+DUPLICATE_SIMILARITY = 0.8
+
+# ------------------------------------------------------------------------------------------
+# Icons
+# ------------------------------------------------------------------------------------------
+
+def user_cache_dir():
+    """Per-user folder for caches that survive a restart (also for the PyInstaller bundle)"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "garmin_waypoint_creator")
+
+class IconAtlas:
+    """All icons of icons_garmin, pre-scaled to the sizes the program uses, in one PNG.
+
+    A JSON index next to the PNG holds the position of every icon and a fingerprint
+    of icons_garmin (names and file sizes of the PNGs; modification times are left
+    out because the PyInstaller bundle is extracted anew on every start). If the
+    fingerprint no longer matches, the atlas is rebuilt. A prebuilt atlas next to
+    the program (see --build-icon-atlas) is preferred; otherwise it is kept in the
+    user's cache folder.
+    """
+    FILENAME = "icons_atlas"
+    VERSION = 1
+
+    def __init__(self, symbols, sizes, directories):
+        self.symbols = symbols
+        self.sizes = sorted(sizes)
+        self.directories = directories  # searched in this order, the last one is written to
+        self.image = None
+        self.positions = {}  # (key, size) -> (x, y)
+
+    def fingerprint(self):
+        digest = hashlib.sha1(f"{self.VERSION} {self.sizes}".encode())
+        for key, icon_path in sorted(self.symbols.icon_paths.items()):
+            try:
+                size = os.path.getsize(icon_path)
+            except OSError:
+                size = -1
+            digest.update(f"\n{key}:{size}".encode())
+        return digest.hexdigest()
+
+    def load(self):
+        """Open a matching atlas. Returns False if none exists or it is outdated."""
+        fingerprint = self.fingerprint()
+        for directory in self.directories:
+            index_path = os.path.join(directory, self.FILENAME + ".json")
+            try:
+                with open(index_path, encoding='utf-8') as f:
+                    index = json.load(f)
+                if index.get("fingerprint") != fingerprint:
+                    continue
+                from PIL import Image
+                image = Image.open(os.path.join(directory, self.FILENAME + ".png"))
+                image.load()
+            except (OSError, ValueError):
+                continue
+            self.positions = {(key, int(size)): tuple(pos)
+                              for size, icons in index["icons"].items()
+                              for key, pos in icons.items()}
+            self.image = image
+            return True
+        return False
+
+    def build(self, directory=None):
+        """Scale all icons once and write atlas and index. Safe to run in a worker thread."""
+        from PIL import Image
+        directory = directory or self.directories[-1]
+        keys = sorted(self.symbols.icon_paths)
+        columns = 16
+        rows_per_size = {size: (len(keys) + columns - 1) // columns for size in self.sizes}
+        width = columns * max(self.sizes)
+        height = sum(size * rows for size, rows in rows_per_size.items())
+        atlas = Image.new("RGBA", (width, max(height, 1)))
+        
+        icons = {str(size): {} for size in self.sizes}
+        positions = {}
+        top = 0
+        for size in self.sizes:
+            for i, key in enumerate(keys):
+                x, y = (i % columns) * size, top + (i // columns) * size
+                try:
+                    with Image.open(self.symbols.icon_path(key)) as image:
+                        atlas.paste(image.convert("RGBA").resize((size, size), Image.Resampling.LANCZOS), (x, y))
+                except Exception as e:
+                    print(f"Failed to load icon {self.symbols.icon_path(key)}: {e}")
+                    continue
+                icons[str(size)][key] = [x, y]
+                positions[(key, size)] = (x, y)
+            top += rows_per_size[size] * size
+        
+        os.makedirs(directory, exist_ok=True)
+        png_path = os.path.join(directory, self.FILENAME + ".png")
+        index_path = os.path.join(directory, self.FILENAME + ".json")
+        # The index is written last and only refers to a complete PNG
+        atlas.save(png_path + ".tmp", format="PNG")
+        os.replace(png_path + ".tmp", png_path)
+        with open(index_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({"fingerprint": self.fingerprint(), "icons": icons}, f)
+        os.replace(index_path + ".tmp", index_path)
+        
+        self.positions = positions
+        self.image = atlas
+
+    def build_in_background(self):
+        def run():
+            try:
+                self.build()
+            except Exception as e:
+                print(f"Icon atlas could not be built: {e}")
+        threading.Thread(target=run, name="icon-atlas", daemon=True).start()
+
+    def crop(self, key, size):
+        """Image of an icon in the given size, or None if it is not in the atlas"""
+        image = self.image
+        position = self.positions.get((key, size))
+        if image is None or position is None:
+            return None
+        x, y = position
+        return image.crop((x, y, x + size, y + size))
+
+class IconCache:
+    """Decodes and scales Garmin icons on first use.
+
+    PhotoImages are kept per (icon key, size) in a least-recently-used cache of at
+    most max_items entries. Markers hold their own reference, so evicting an icon
+    that is still on the map only means it is decoded again when needed next time.
+    """
+    def __init__(self, symbols, atlas=None, max_items=160):
+        self.symbols = symbols
+        self.atlas = atlas
+        self.max_items = max_items
+        self.images = OrderedDict()  # (key, size) -> PhotoImage
+        self.missing = set()         # (key, size) that could not be loaded
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, size):
+        """PhotoImage of an icon in size x size pixels, or None if there is no such icon"""
+        cache_key = (key, size)
+        image = self.images.get(cache_key)
+        if image is not None:
+            self.hits += 1
+            self.images.move_to_end(cache_key)
+            return image
+        if cache_key in self.missing:
+            return None
+        
+        self.misses += 1
+        image = self.load(key, size)
+        if image is None:
+            self.missing.add(cache_key)
+            return None
+        self.images[cache_key] = image
+        while len(self.images) > self.max_items:
+            self.images.popitem(last=False)
+        return image
+
+    @instrumentation.timed("icon_decode")
+    def load(self, key, size):
+        from PIL import Image, ImageTk
+        if self.atlas is not None:
+            image = self.atlas.crop(key, size)
+            if image is not None:
+                return ImageTk.PhotoImage(image)
+        icon_path = self.symbols.icon_path(key)
+        if icon_path is None:
+            return None
+        try:
+            with Image.open(icon_path) as image:
+                return ImageTk.PhotoImage(image.resize((size, size), Image.Resampling.LANCZOS))
+        except Exception as e:
+            print(f"Failed to load icon {icon_path}: {e}")
+            return None
+
+    def prewarm(self, keys, size):
+        for key in keys:
+            if key is not None:
+                self.get(key, size)
+
+# ------------------------------------------------------------------------------------------
+# Map tiles
+# ------------------------------------------------------------------------------------------
+
+class TileStore:
+    """Disk cache for map tiles in a SQLite file.
+
+    The map reads tiles from here first and writes every downloaded tile through.
+    When the stored tiles exceed max_bytes the least recently used ones are
+    evicted. The tile loader threads of the map use the store concurrently, so
+    all access goes through one lock.
+    """
+    TOUCH_INTERVAL = 3600  # seconds; last_access is refreshed at most this often
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        import sqlite3
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS tiles (
+                               server TEXT NOT NULL,
+                               zoom INTEGER NOT NULL,
+                               x INTEGER NOT NULL,
+                               y INTEGER NOT NULL,
+                               data BLOB NOT NULL,
+                               size INTEGER NOT NULL,
+                               last_access INTEGER NOT NULL,
+                               PRIMARY KEY (server, zoom, x, y))""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS tiles_last_access ON tiles (last_access)")
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM tiles").fetchone()[0]
+
+    def get(self, server, zoom, x, y):
+        """Tile data as bytes, or None if the tile is not cached"""
+        now = int(time.time())
+        with self.lock:
+            row = self.db.execute("SELECT data, last_access FROM tiles WHERE server=? AND zoom=? AND x=? AND y=?",
+                                  (server, zoom, x, y)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if now - row[1] > self.TOUCH_INTERVAL:
+                self.db.execute("UPDATE tiles SET last_access=? WHERE server=? AND zoom=? AND x=? AND y=?",
+                                (now, server, zoom, x, y))
+            return row[0]
+
+    def contains(self, server, zoom, x, y):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM tiles WHERE server=? AND zoom=? AND x=? AND y=?",
+                                   (server, zoom, x, y)).fetchone() is not None
+
+    def put(self, server, zoom, x, y, data):
+        with self.lock:
+            old = self.db.execute("SELECT size FROM tiles WHERE server=? AND zoom=? AND x=? AND y=?",
+                                  (server, zoom, x, y)).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (server, zoom, x, y, data, len(data), int(time.time())))
+            self.total_bytes += len(data) - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self.evict(int(self.max_bytes * 0.9))
+
+    def delete(self, server, zoom, x, y):
+        with self.lock:
+            old = self.db.execute("SELECT size FROM tiles WHERE server=? AND zoom=? AND x=? AND y=?",
+                                  (server, zoom, x, y)).fetchone()
+            if old:
+                self.db.execute("DELETE FROM tiles WHERE server=? AND zoom=? AND x=? AND y=?", (server, zoom, x, y))
+                self.total_bytes -= old[0]
+
+    def evict(self, target_bytes):
+        """Delete the least recently used tiles until the store is below target_bytes"""
+        while self.total_bytes > target_bytes:
+            rows = self.db.execute("SELECT rowid, size FROM tiles ORDER BY last_access LIMIT 256").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+            self.db.executemany("DELETE FROM tiles WHERE rowid=?", [(rowid,) for rowid, _ in rows])
+            self.total_bytes -= sum(size for _, size in rows)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+def tiles_for_bounds(bounds, zoom):
+    """All tiles (zoom, x, y) covering bounds = (south, west, north, east)"""
+    south, west, north, east = bounds
+    n = 1 << zoom
+    x_min, y_min = world_xy(north, west)
+    x_max, y_max = world_xy(south, east)
+    return [(zoom, x, y)
+            for x in range(int(x_min * n), int(x_max * n) + 1)
+            for y in range(int(y_min * n), int(y_max * n) + 1)]
+
+def tiles_around_waypoints(waypoints, zoom, radius=1):
+    """Tiles of the waypoints and the radius tiles around each of them"""
+    n = 1 << zoom
+    tiles = set()
+    for waypoint in waypoints:
+        x, y = world_xy(waypoint.lat, waypoint.lon)
+        tile_x, tile_y = int(x * n), int(y * n)
+        for dx in range(-radius, radius + 1):
+            for dy in range(-radius, radius + 1):
+                if 0 <= tile_x + dx < n and 0 <= tile_y + dy < n:
+                    tiles.add((zoom, tile_x + dx, tile_y + dy))
+    return tiles
 
 class GarminWaypointCreator:
     def __init__(self):
@@ -42,6 +413,7 @@ class GarminWaypointCreator:
         
         # Waypoint data
         self.current_waypoint = None
+        self.current_waypoint_index = None  # position of the waypoint in its file
         self.waypoint_lat = None
         self.waypoint_lon = None
         self.edit_window = None
@@ -51,12 +423,49 @@ class GarminWaypointCreator:
         self.move_mode = False
         self.temp_move_marker = None
         
-        # Store map markers for cleanup
-        self.map_markers = []
+        # Parsed waypoints of the working directory, re-read only when a file changes
+        if WAYPOINT_DATABASE:
+            self.waypoint_store = WaypointDatabase(WAYPOINT_DATABASE, cluster_max_zoom=CLUSTER_MAX_ZOOM)
+        else:
+            self.waypoint_store = WaypointStore(cluster_max_zoom=CLUSTER_MAX_ZOOM)
+        self.waypoint_loader = WaypointLoader()
+        
+        # Parsed waypoints of the last run (not needed with the database)
+        self.index_cache = None
+        if WAYPOINT_INDEX and not self.waypoint_store.database:
+            self.index_cache = WaypointIndexCache(self.waypoint_store.directory)
+        self.index_restored = False
+        
+        # Saved waypoints are written in the background, several saves of a file in a row become one write
+        self.save_queue = SaveQueue()
+        self.save_poll_scheduled = False
+        
+        # Offset indexes of files with several waypoints (filename -> GpxCollection)
+        self.collections = {}
         
-        # Icon cache for loaded images
-        self.icon_cache = {}
-        self.icon_images = {}  # For Tkinter PhotoImage objects
+        # Reports GPX files changed by other programs
+        self.folder_watcher = None
+        
+        # Instrumentation: start of the running reload and the statistics window
+        self.reload_started = None
+        self.stats_window = None
+        
+        # Duplicate finder: its window and the groups found (lists of Waypoint, the first is kept)
+        self.duplicate_window = None
+        self.duplicate_groups = []
+        
+        # Markers exist only for waypoints inside the visible map area (Waypoint -> marker)
+        self.map_markers = {}
+        self.visible_bounds = None
+        self.last_view = None
+        
+        # Tile download for offline use
+        self.prefetch_window = None
+        self.prefetcher = None
+        
+        # Count markers for clustered zoom levels ((zoom, cell) -> [count, marker])
+        self.cluster_markers = {}
+        self.cluster_update_pending = False
         
         # Get the directory where the script is located
         if getattr(sys, 'frozen', False):
@@ -69,85 +478,30 @@ class GarminWaypointCreator:
         self.icons_dir = os.path.join(self.base_dir, "icons_garmin")
         
         # Garmin icons mapping
-        self.garmin_icons = {
-            "Campground": "Campground",
-            "RV Park": "RV Park",
-            "Scenic Area": "Scenic Area",
-            "Museum": "Museum",
-            "Church": "Church",
-            "Information": "Information",
-            "Parking Area": "Parking Area",
-            "Restaurant": "Restaurant",
-            "Winery": "Winery",
-            "Hotel": "Hotel",
-            "Lodge": "Lodge",
-            "Funicular"         	: "Funicular.png",
-            "Gas Station": "Gas Station",
-            "Bar": "Bar",
-            "Library": "Library",
-            "Theater": "Theater",
-            "Swimming Area": "Swimming Area",
-            "Waypoint": "Waypoint",
-            "Summit": "Summit",
-            "Geocache": "Geocache",
-            "Car": "Car",
-            "Flag": "Flag",
-            "Truck Stop": "Truck Stop",
-            "Airport": "Airport",
-            "Shopping": "Shopping",
-            "School": "School",
-            "Cemetery": "Cemetery",
-            "Park": "Park",
-            "Picnic Area": "Picnic Area",
-            "Restroom": "Restroom",
-            "Telephone": "Telephone",
-            "Medical Facility": "Medical Facility",
-            "Pharmacy": "Pharmacy",
-            "Police Station": "Police Station",
-            "Fire Department": "Fire Department",
-            "Bank": "Bank",
-            "Fast Food": "Fast Food",
-            "Pizza": "Pizza",
-            "Stadium": "Stadium",
-            "Golf Course": "Golf Course",
-            "Skiing Area": "Skiing Area",
-            "Dam": "Dam",
-            "Controlled Area": "Controlled Area",
-            "Danger Area": "Danger Area",
-            "Restricted Area": "Restricted Area",
-            "Null": "Null",
-            "Ball Park": "Ball Park",
-            "Car Rental": "Car Rental",
-            "City (Capitol)": "City (Capitol)",
-            "City (Large)": "City (Large)",
-            "City (Medium)": "City (Medium)",
-            "City (Small)": "City (Small)",
-            "Civil": "Civil",
-            "Coast Guard": "Coast Guard",
-            "Contact, Afro": "Contact, Afro",
-            "Contact, Alien": "Contact, Alien",
-            "Contact, Ball Cap": "Contact, Ball Cap",
-            "Contact, Big Ears": "Contact, Big Ears",
-            "Contact, Biker": "Contact, Biker",
-            "Contact, Bug": "Contact, Bug",
-            "Contact, Cat": "Contact, Cat",
-            "Contact, Dog": "Contact, Dog",
-            "Contact, Dreadlocks": "Contact, Dreadlocks",
-            "Contact, Female1": "Contact, Female1",
-            "Contact, Female2": "Contact, Female2",
-            "Contact, Female3": "Contact, Female3",
-            "Contact, Goatee": "Contact, Goatee",
-            "Contact, Kung-Fu": "Contact, Kung-Fu",
-            "Contact, Pirate": "Contact, Pirate",
-            "Contact, Ranger": "Contact, Ranger",
-            "Contact, Smiley": "Contact, Smiley",
-            "Contact, Spike": "Contact, Spike",
-            "Contact, Sumo": "Contact, Sumo"
-        }
+        self.garmin_icons = GARMIN_ICONS
+        
+        # Lookup between icon names and <sym> values for all icons in icons_garmin
+        self.symbols = SymbolRegistry(self.icons_dir, self.garmin_icons)
         
+        # Icons come from a prebuilt atlas (built on the first start) and are cached per (icon, size)
+        self.icon_atlas = IconAtlas(self.symbols, (MAP_ICON_SIZE, LARGE_ICON_SIZE), [self.base_dir, user_cache_dir()])
+        self.icon_cache = IconCache(self.symbols, self.icon_atlas)
+        
+        # Show the window before map, icons and waypoints are loaded
+        self.splash = ttk.Label(self.root, text="Karte wird geladen ...")
+        self.splash.pack(expand=True)
+        self.root.update()
+        
+        self.start_up()
+        
+    @instrumentation.timed("start_up")
+    def start_up(self):
+        """Everything the window needs beyond the splash; imports the map on the way"""
         self.setup_ui()
+        self.splash.destroy()
+        self.splash = None
         
-        # Load icons in background
+        # Check the icons; they are loaded when a marker or the edit window needs them
         self.load_garmin_icons()
         
     def setup_ui(self):
@@ -163,16 +517,40 @@ class GarminWaypointCreator:
         self.info_label = ttk.Label(self.map_frame, text="Klicken Sie auf die Karte, um einen Waypoint zu erstellen")
         self.info_label.pack(pady=5)
         
-        # Create map widget
-        self.map_widget = tkintermapview.TkinterMapView(self.map_frame, width=1000, height=600, corner_radius=0)
+        # Search over name, text and symbol of all waypoints
+        search_frame = ttk.Frame(self.map_frame)
+        search_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(search_frame, text="Suchen:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", self.on_search_change)
+        self.search_entry = ttk.Entry(search_frame, textvariable=self.search_var, width=40)
+        self.search_entry.pack(side=tk.LEFT, padx=(5, 0))
+        self.search_entry.bind('<FocusIn>', self.prepare_search)
+        self.search_entry.bind('<Down>', self.focus_search_results)
+        self.search_entry.bind('<Return>', self.jump_to_first_result)
+        self.search_entry.bind('<Escape>', self.clear_search)
+        
+        # Create map widget; tiles are kept in a cache on disk and can be used offline.
+        # The map (with tkintermapview and requests) is imported here, after the window is shown.
+        import garmin_waypoint_map
+        self.tile_store = TileStore(os.path.join(user_cache_dir(), "tiles.sqlite"), TILE_CACHE_MAX_MB * 1024 * 1024)
+        self.offline_var = tk.BooleanVar(value=START_OFFLINE)
+        self.map_widget = garmin_waypoint_map.CachedMapView(self.map_frame, width=1000, height=600, corner_radius=0,
+                                                            tile_store=self.tile_store, offline=START_OFFLINE)
         self.map_widget.pack(fill=tk.BOTH, expand=True)
         
+        # Hits of the search, shown over the map while there are any
+        self.search_results = []
+        self.search_list = tk.Listbox(self.map_frame, width=60, exportselection=False)
+        self.search_list.bind('<<ListboxSelect>>', self.on_search_select)
+        self.search_list.bind('<Escape>', self.clear_search)
+        
         # Set position to Burgos and zoom
         self.map_widget.set_position(42.34378014586935, -3.6960958297369473)  # Burgos coordinates
         self.map_widget.set_zoom(8)
         
         # Set map source to OpenStreetMap
-        self.map_widget.set_tile_server("https://a.tile.openstreetmap.org/{z}/{x}/{y}.png")
+        self.map_widget.set_tile_server(TILE_SERVER)
         
         # Add click event
         self.map_widget.add_left_click_map_command(self.on_map_click)
@@ -181,158 +559,770 @@ class GarminWaypointCreator:
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(fill=tk.X, pady=10)
         
-        # Refresh button
+        # Refresh button (imports new or changed GPX files when a database is used)
         refresh_button = ttk.Button(button_frame, text="Waypoints aktualisieren", command=self.load_waypoints)
         refresh_button.pack(side=tk.LEFT)
         
+        # Import of GPX files from any folder and export of the database for BaseCamp
+        if self.waypoint_store.database:
+            import_button = ttk.Button(button_frame, text="GPX importieren", command=self.import_waypoints)
+            import_button.pack(side=tk.LEFT, padx=(10, 0))
+            export_button = ttk.Button(button_frame, text="GPX exportieren", command=self.export_waypoints)
+            export_button.pack(side=tk.LEFT, padx=(10, 0))
+        
+        # Download the tiles of an area into the cache
+        prefetch_button = ttk.Button(button_frame, text="Karten vorladen", command=self.open_prefetch_window)
+        prefetch_button.pack(side=tk.LEFT, padx=(10, 0))
+        
+        # Waypoints saved more than once
+        duplicate_button = ttk.Button(button_frame, text="Duplikate", command=self.open_duplicate_window)
+        duplicate_button.pack(side=tk.LEFT, padx=(10, 0))
+        
+        # Offline switch: only tiles from the cache are shown
+        offline_check = ttk.Checkbutton(button_frame, text="Offline", variable=self.offline_var, command=self.on_offline_change)
+        offline_check.pack(side=tk.LEFT, padx=(10, 0))
+        
+        # Pick up GPX files that other programs put into the folder
+        self.watch_var = tk.BooleanVar(value=WATCH_FOLDER)
+        watch_check = ttk.Checkbutton(button_frame, text="Ordner beobachten", variable=self.watch_var, command=self.on_watch_change)
+        watch_check.pack(side=tk.LEFT, padx=(10, 0))
+        
+        # Timings of the hot paths, only with instrumentation
+        if instrumentation.enabled:
+            stats_button = ttk.Button(button_frame, text="Statistik", command=self.open_stats_window)
+            stats_button.pack(side=tk.LEFT, padx=(10, 0))
+        
         # Close button
         close_button = ttk.Button(button_frame, text="Programm schließen", command=self.close_program)
         close_button.pack(side=tk.RIGHT)
         
         # Load existing waypoints after UI setup
         self.root.after(100, self.load_waypoints)
+        self.on_watch_change()
+        
+        # Keep the markers in line with the visible map area
+        self.root.after(150, self.watch_viewport)
+        
+    def import_waypoints(self):
+        """Import GPX files into the database; a file imported before is replaced"""
+        filenames = filedialog.askopenfilenames(title="GPX importieren", filetypes=[("GPX", "*.gpx")])
+        if not filenames:
+            return
+        store = self.waypoint_store
+        folder = os.path.abspath(store.directory)
+        # Files of the own folder keep the name they have in the database
+        gpx_files = [store.filename_for(os.path.basename(f)) if os.path.dirname(os.path.abspath(f)) == folder else f
+                     for f in filenames]
+        old_waypoints = [w for gpx_file in gpx_files for w in store.waypoints.get(gpx_file, [])]
+        try:
+            count = store.import_gpx(gpx_files)
+        except Exception as e:
+            messagebox.showerror("Fehler", f"Fehler beim Importieren: {e}")
+            count = None
+        self.remove_waypoint_markers(old_waypoints)
+        self.add_waypoint_markers([w for gpx_file in gpx_files for w in store.waypoints.get(gpx_file, [])])
+        if count is not None:
+            messagebox.showinfo("Importiert", f"{count} Waypoints aus {len(gpx_files)} Dateien importiert.")
+
+    def export_waypoints(self):
+        """Write all waypoints of the database into one GPX file"""
+        filename = filedialog.asksaveasfilename(title="GPX exportieren", defaultextension=".gpx",
+                                                filetypes=[("GPX", "*.gpx")])
+        if not filename:
+            return
+        try:
+            count = self.waypoint_store.export_gpx(filename)
+        except Exception as e:
+            messagebox.showerror("Fehler", f"Fehler beim Exportieren: {e}")
+            return
+        messagebox.showinfo("Exportiert", f"{count} Waypoints nach {filename} exportiert.")
+
+    def on_watch_change(self):
+        if self.watch_var.get() and self.folder_watcher is None:
+            self.folder_watcher = FolderWatcher(self.waypoint_store.directory)
+            self.folder_watcher.start()
+            self.root.after(250, self.poll_folder_watcher, self.folder_watcher)
+        elif not self.watch_var.get() and self.folder_watcher is not None:
+            self.folder_watcher.stop()
+            self.folder_watcher = None
+
+    def poll_folder_watcher(self, watcher):
+        """Apply the files changed by other programs once a burst of changes is over.
+        The loop belongs to one watcher and ends with it, so switching the watcher off
+        and on again quickly does not leave a second loop running."""
+        if self.folder_watcher is not watcher:
+            return
+        if watcher.ready(WATCH_QUIET, WATCH_MAX_DELAY):
+            self.load_waypoints(watcher.take())
+        self.root.after(250, self.poll_folder_watcher, watcher)
+
+    def on_offline_change(self):
+        self.map_widget.offline = self.offline_var.get()
+        if not self.map_widget.offline:
+            # Reload the tiles that stayed empty while offline
+            self.map_widget.set_zoom(round(self.map_widget.zoom))
+
+    def open_prefetch_window(self):
+        """Dialog to download the tiles of the visible area or around all waypoints"""
+        if self.prefetch_window:
+            self.prefetch_window.lift()
+            return
+        window = self.prefetch_window = tk.Toplevel(self.root)
+        window.title("Karten vorladen")
+        window.transient(self.root)
+        window.geometry("+%d+%d" % (self.root.winfo_rootx() + 300, self.root.winfo_rooty() + 150))
+        window.protocol("WM_DELETE_WINDOW", self.close_prefetch_window)
+        
+        frame = ttk.Frame(window)
+        frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=20)
+        
+        ttk.Label(frame, text="Bereich:", font=("Arial", 10, "bold")).pack(anchor=tk.W)
+        self.prefetch_area_var = tk.StringVar(value="view")
+        ttk.Radiobutton(frame, text="Sichtbarer Kartenausschnitt", variable=self.prefetch_area_var, value="view").pack(anchor=tk.W)
+        ttk.Radiobutton(frame, text="Um alle Waypoints", variable=self.prefetch_area_var, value="waypoints").pack(anchor=tk.W)
+        
+        zoom_frame = ttk.Frame(frame)
+        zoom_frame.pack(fill=tk.X, pady=10)
+        zoom = round(self.map_widget.zoom)
+        ttk.Label(zoom_frame, text="Zoom von").pack(side=tk.LEFT)
+        self.prefetch_zoom_from = tk.IntVar(value=zoom)
+        ttk.Spinbox(zoom_frame, from_=0, to=19, width=4, textvariable=self.prefetch_zoom_from).pack(side=tk.LEFT, padx=5)
+        ttk.Label(zoom_frame, text="bis").pack(side=tk.LEFT)
+        self.prefetch_zoom_to = tk.IntVar(value=min(zoom + 4, 17))
+        ttk.Spinbox(zoom_frame, from_=0, to=19, width=4, textvariable=self.prefetch_zoom_to).pack(side=tk.LEFT, padx=5)
+        
+        self.prefetch_label = ttk.Label(frame, text="")
+        self.prefetch_label.pack(anchor=tk.W, pady=5)
+        
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(fill=tk.X, pady=(10, 0))
+        self.prefetch_start_button = ttk.Button(button_frame, text="Start", command=self.start_prefetch)
+        self.prefetch_start_button.pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="Schließen", command=self.close_prefetch_window).pack(side=tk.RIGHT)
+
+    def start_prefetch(self):
+        try:
+            zoom_from, zoom_to = sorted((self.prefetch_zoom_from.get(), self.prefetch_zoom_to.get()))
+        except tk.TclError:
+            messagebox.showerror("Fehler", "Ungültige Zoomstufe", parent=self.prefetch_window)
+            return
+        
+        tiles = set()
+        if self.prefetch_area_var.get() == "waypoints":
+            waypoints = list(self.waypoint_store.all_waypoints())
+            for zoom in range(zoom_from, zoom_to + 1):
+                tiles.update(tiles_around_waypoints(waypoints, zoom))
+        else:
+            south, west, north, east = self.get_view_bounds()
+            # get_view_bounds adds half a screen on every side, prefetch the visible area only
+            lat_margin, lon_margin = (north - south) / 4, (east - west) / 4
+            bounds = (south + lat_margin, west + lon_margin, north - lat_margin, east - lon_margin)
+            for zoom in range(zoom_from, zoom_to + 1):
+                tiles.update(tiles_for_bounds(bounds, zoom))
+        
+        if not tiles:
+            return
+        if len(tiles) > 20000 and not messagebox.askyesno(
+                "Karten vorladen", f"{len(tiles)} Kacheln herunterladen?", parent=self.prefetch_window):
+            return
         
+        import garmin_waypoint_map
+        self.prefetcher = garmin_waypoint_map.TilePrefetcher(self.tile_store, self.map_widget.tile_server)
+        self.prefetcher.start(tiles)
+        self.prefetch_start_button.config(state=tk.DISABLED)
+        self.update_prefetch_progress()
+
+    def update_prefetch_progress(self):
+        prefetcher = self.prefetcher
+        if prefetcher is None or not self.prefetch_window:
+            return
+        text = f"{prefetcher.done} von {prefetcher.total} Kacheln ({prefetcher.skipped} schon vorhanden, {prefetcher.failed} Fehler)"
+        if prefetcher.running:
+            self.prefetch_label.config(text=text)
+            self.root.after(250, self.update_prefetch_progress)
+        else:
+            self.prefetch_label.config(text=text + " - fertig")
+            self.prefetch_start_button.config(state=tk.NORMAL)
+            self.prefetcher = None
+
+    def close_prefetch_window(self):
+        if self.prefetcher is not None:
+            self.prefetcher.cancel()
+            self.prefetcher = None
+        self.prefetch_window.destroy()
+        self.prefetch_window = None
+
+    def prepare_search(self, event=None):
+        """Build the search index when the search box is entered, before the first key is typed"""
+        if self.waypoint_store.search_index is None:
+            self.waypoint_store.search("")
+
+    def on_search_change(self, *args):
+        """List the hits of the search while typing"""
+        self.search_results = self.waypoint_store.search(self.search_var.get(), SEARCH_LIMIT)
+        self.search_list.delete(0, tk.END)
+        for waypoint in self.search_results:
+            self.search_list.insert(tk.END, f"{waypoint.name}  ({waypoint.symbol})")
+        if self.search_results:
+            self.search_list.config(height=min(len(self.search_results), 10))
+            self.search_list.place(in_=self.map_widget, x=10, y=10)
+            self.search_list.lift()
+        else:
+            self.search_list.place_forget()
+
+    def focus_search_results(self, event=None):
+        if self.search_results:
+            self.search_list.focus_set()
+            self.search_list.selection_clear(0, tk.END)
+            self.search_list.selection_set(0)
+            self.search_list.activate(0)
+            self.jump_to_waypoint(self.search_results[0])
+        return "break"
+
+    def on_search_select(self, event=None):
+        selection = self.search_list.curselection()
+        if selection:
+            self.jump_to_waypoint(self.search_results[selection[0]])
+
+    def jump_to_first_result(self, event=None):
+        if self.search_results:
+            self.jump_to_waypoint(self.search_results[0])
+
+    def clear_search(self, event=None):
+        self.search_var.set("")
+        self.search_entry.focus_set()
+
+    def jump_to_waypoint(self, waypoint):
+        """Centre the map on a waypoint, zoomed in far enough to show its own marker"""
+        if round(self.map_widget.zoom) < SEARCH_ZOOM:
+            self.map_widget.set_zoom(SEARCH_ZOOM)
+        self.map_widget.set_position(waypoint.lat, waypoint.lon)
+
+    def open_stats_window(self):
+        """Small window with the timings and counters of the instrumentation"""
+        if self.stats_window is not None:
+            self.stats_window.lift()
+            return
+        window = self.stats_window = tk.Toplevel(self.root)
+        window.title("Statistik")
+        window.transient(self.root)
+        window.protocol("WM_DELETE_WINDOW", self.close_stats_window)
+        
+        frame = ttk.Frame(window)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.stats_label = ttk.Label(frame, justify=tk.LEFT, font=("Arial", 10))
+        self.stats_label.pack(anchor=tk.W)
+        
+        columns = ("count", "total", "mean", "max", "last")
+        self.stats_tree = ttk.Treeview(frame, columns=columns, height=12)
+        self.stats_tree.heading("#0", text="Pfad")
+        for column, text in zip(columns, ("Anzahl", "Summe ms", "Mittel ms", "Max ms", "Zuletzt ms")):
+            self.stats_tree.heading(column, text=text)
+            self.stats_tree.column(column, width=90, anchor=tk.E)
+        self.stats_tree.pack(fill=tk.BOTH, expand=True, pady=(10, 0))
+        self.update_stats_window()
+
+    def update_stats_window(self):
+        if self.stats_window is None:
+            return
+        timings, counters = instrumentation.snapshot()
+        reload = timings.get("reload")
+        tile_requests = self.tile_store.hits + self.tile_store.misses
+        icon_requests = self.icon_cache.hits + self.icon_cache.misses
+        lines = [
+            "Letztes Aktualisieren: " + (f"{reload[3] * 1000:.0f} ms" if reload else "-"),
+            f"Dateien gelesen: {counters.get('files_parsed', 0)} ({counters.get('waypoints_parsed', 0)} Waypoints)",
+            f"Dateien gespeichert: {counters.get('files_saved', 0)}",
+            f"Marker sichtbar: {len(self.map_markers)} (+ {len(self.cluster_markers)} Gruppen)",
+            f"Icon-Cache: {self.icon_cache.hits} Treffer von {icon_requests}"
+            + (f" ({100 * self.icon_cache.hits / icon_requests:.0f} %)" if icon_requests else ""),
+            f"Kachel-Cache: {self.tile_store.hits} Treffer von {tile_requests}"
+            + (f" ({100 * self.tile_store.hits / tile_requests:.0f} %)" if tile_requests else ""),
+        ]
+        self.stats_label.config(text="\n".join(lines))
+        
+        self.stats_tree.delete(*self.stats_tree.get_children())
+        for name, (count, total, longest, last) in sorted(timings.items(), key=lambda item: -item[1][1]):
+            self.stats_tree.insert("", tk.END, text=name, values=(
+                count, f"{total * 1000:.1f}", f"{total / count * 1000:.2f}", f"{longest * 1000:.1f}", f"{last * 1000:.1f}"))
+        self.stats_window.after(1000, self.update_stats_window)
+
+    def close_stats_window(self):
+        self.stats_window.destroy()
+        self.stats_window = None
+
+    def open_duplicate_window(self):
+        """Window listing groups of waypoints that are probably the same place"""
+        if self.duplicate_window is not None:
+            self.duplicate_window.lift()
+            return
+        window = self.duplicate_window = tk.Toplevel(self.root)
+        window.title("Duplikate")
+        window.transient(self.root)
+        window.geometry("+%d+%d" % (self.root.winfo_rootx() + 200, self.root.winfo_rooty() + 100))
+        window.protocol("WM_DELETE_WINDOW", self.close_duplicate_window)
+        
+        frame = ttk.Frame(window)
+        frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        settings_frame = ttk.Frame(frame)
+        settings_frame.pack(fill=tk.X)
+        ttk.Label(settings_frame, text="Abstand bis").pack(side=tk.LEFT)
+        self.duplicate_distance = tk.IntVar(value=DUPLICATE_DISTANCE)
+        ttk.Spinbox(settings_frame, from_=1, to=1000, width=5, textvariable=self.duplicate_distance).pack(side=tk.LEFT, padx=5)
+        ttk.Label(settings_frame, text="m, Namen ähnlich ab").pack(side=tk.LEFT)
+        self.duplicate_similarity = tk.IntVar(value=round(DUPLICATE_SIMILARITY * 100))
+        ttk.Spinbox(settings_frame, from_=0, to=100, width=4, textvariable=self.duplicate_similarity).pack(side=tk.LEFT, padx=5)
+        ttk.Label(settings_frame, text="%").pack(side=tk.LEFT)
+        ttk.Button(settings_frame, text="Suchen", command=self.find_duplicate_groups).pack(side=tk.LEFT, padx=(10, 0))
+        
+        self.duplicate_label = ttk.Label(frame, text="")
+        self.duplicate_label.pack(anchor=tk.W, pady=5)
+        
+        columns = ("file", "symbol")
+        self.duplicate_tree = ttk.Treeview(frame, columns=columns, height=15)
+        self.duplicate_tree.heading("#0", text="Waypoint")
+        self.duplicate_tree.heading("file", text="Datei")
+        self.duplicate_tree.heading("symbol", text="Symbol")
+        self.duplicate_tree.column("#0", width=280)
+        self.duplicate_tree.pack(fill=tk.BOTH, expand=True)
+        self.duplicate_tree.bind('<<TreeviewSelect>>', self.on_duplicate_select)
+        
+        button_frame = ttk.Frame(frame)
+        button_frame.pack(fill=tk.X, pady=(10, 0))
+        ttk.Button(button_frame, text="Alle auswählen",
+                   command=lambda: self.duplicate_tree.selection_set(self.duplicate_tree.get_children())).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="Zusammenführen",
+                   command=lambda: self.resolve_duplicates(merge=True)).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Button(button_frame, text="Doppelte löschen",
+                   command=lambda: self.resolve_duplicates(merge=False)).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Button(button_frame, text="Schließen", command=self.close_duplicate_window).pack(side=tk.RIGHT)
+        
+        self.find_duplicate_groups()
+
+    @instrumentation.timed("find_duplicates")
+    def find_duplicate_groups(self):
+        try:
+            distance = self.duplicate_distance.get()
+            similarity = self.duplicate_similarity.get() / 100
+            if distance <= 0:
+                raise tk.TclError("distance")
+        except tk.TclError:
+            messagebox.showerror("Fehler", "Ungültiger Wert", parent=self.duplicate_window)
+            return
+        self.duplicate_groups = find_duplicates(self.waypoint_store.all_waypoints(), distance, similarity)
+        
+        tree = self.duplicate_tree
+        tree.delete(*tree.get_children())
+        for i, group in enumerate(self.duplicate_groups):
+            tree.insert("", tk.END, iid=f"g{i}", text=f"{len(group)} × {group[0].name or '(ohne Name)'}", open=True)
+            for j, waypoint in enumerate(group):
+                text = (waypoint.name or "(ohne Name)") + (" (bleibt)" if j == 0 else "")
+                tree.insert(f"g{i}", tk.END, iid=f"g{i}.{j}", text=text, values=(waypoint.filename, waypoint.symbol))
+        count = sum(len(group) - 1 for group in self.duplicate_groups)
+        self.duplicate_label.config(text=f"{len(self.duplicate_groups)} Gruppen, {count} doppelte Waypoints")
+
+    def on_duplicate_select(self, event=None):
+        """Show the chosen group or waypoint on the map"""
+        focus = self.duplicate_tree.focus()
+        if not focus:
+            return
+        group, _, member = focus[1:].partition(".")
+        self.jump_to_waypoint(self.duplicate_groups[int(group)][int(member or 0)])
+
+    def resolve_duplicates(self, merge):
+        """Keep the first waypoint of every selected group and delete the others; with merge
+        the kept one also gets the longest text and the links of all. Only the affected
+        <wpt> elements of the affected files are written and only their markers change."""
+        if self.edit_window:
+            messagebox.showinfo("Duplikate", "Bitte schließen Sie zuerst das Bearbeitungsfenster.",
+                                parent=self.duplicate_window)
+            return
+        selected = {iid[1:].partition(".")[0] for iid in self.duplicate_tree.selection()}
+        # Groups changed since the search are left out
+        groups = [self.duplicate_groups[int(i)] for i in sorted(selected, key=int)]
+        groups = [group for group in groups if all(self.waypoint_store.get(w.id) is w for w in group)]
+        if not groups:
+            return
+        count = sum(len(group) - 1 for group in groups)
+        action = "zusammenführen" if merge else "löschen"
+        if not messagebox.askyesno("Duplikate", f"{count} Waypoints aus {len(groups)} Gruppen {action}?",
+                                   parent=self.duplicate_window):
+            return
+        
+        replaced = {group[0]: merge_waypoints(group) for group in groups} if merge else {}
+        deleted = {waypoint for group in groups for waypoint in group[1:]}
+        try:
+            for gpx_file in {w.filename for w in deleted} | {w.filename for w in replaced}:
+                old_waypoints = self.waypoint_store.waypoints.get(gpx_file, [])
+                waypoints = [replaced.get(w, w) for w in old_waypoints if w not in deleted]
+                if waypoints:
+                    # Puts first, then deletes from the back, so every index still means the old position
+                    changes = [("put", i, replaced[w]) for i, w in enumerate(old_waypoints) if w in replaced]
+                    changes += [("delete", i) for i in reversed(range(len(old_waypoints))) if old_waypoints[i] in deleted]
+                    for i, waypoint in enumerate(waypoints):
+                        waypoint.index = i
+                    self.save_waypoint_file(gpx_file, waypoints, changes)
+                else:
+                    self.delete_waypoint_file(gpx_file)
+        except Exception as e:
+            messagebox.showerror("Fehler", f"Fehler beim Löschen: {e}", parent=self.duplicate_window)
+        self.find_duplicate_groups()
+
+    def close_duplicate_window(self):
+        self.duplicate_window.destroy()
+        self.duplicate_window = None
+        self.duplicate_groups = []
+
+    @instrumentation.timed("load_garmin_icons")
     def load_garmin_icons(self):
-        """Load Garmin icons from the local icons_garmin folder"""
+        """Check the local icons_garmin folder. The icons themselves are decoded lazily by the icon cache."""
         if not os.path.exists(self.icons_dir):
             print(f"Icons directory not found: {self.icons_dir}")
             print("Please create 'icons_garmin' folder next to the program with PNG icons")
             return
             
-        try:
-            # Scan for all PNG files in the icons directory
-            icon_files = glob.glob(os.path.join(self.icons_dir, "*.png"))
-            
-            for icon_path in icon_files:
-                try:
-                    # Get filename without extension
-                    icon_filename = os.path.basename(icon_path)
-                    icon_name = icon_filename.replace('.png', '')
-                    
-                    # Check if this icon is in our Garmin icons mapping
-                    if icon_name in self.garmin_icons:
-                        # Load image
-                        image = Image.open(icon_path)
-                        
-                        # Create different sizes
-                        # For map display (24x24 pixels)
-                        image_map = image.resize((24, 24), Image.Resampling.LANCZOS)
-                        photo_map = ImageTk.PhotoImage(image_map)
-                        
-                        # For icon selection dialog (32x32 pixels)
-                        image_large = image.resize((32, 32), Image.Resampling.LANCZOS)
-                        photo_large = ImageTk.PhotoImage(image_large)
-                        
-                        # Store in cache
-                        self.icon_cache[icon_name] = {
-                            'map': photo_map,
-                            'large': photo_large,
-                            'path': icon_path
-                        }
-                        
-                except Exception as e:
-                    print(f"Failed to load icon {icon_path}: {e}")
-                    
-            print(f"Loaded {len(self.icon_cache)} Garmin icons from {self.icons_dir}")
+        print(f"Found {len(self.symbols.icon_paths)} Garmin icons in {self.icons_dir}")
+        
+        if len(self.symbols.icon_paths) == 0:
+            print("No icons found. Make sure PNG files are named exactly like the Garmin icon names.")
+            print("Example: 'Scenic Area.png', 'Restaurant.png', 'Gas Station.png', etc.")
+            return
+        
+        # One file read instead of hundreds; until the atlas exists icons come from the PNGs
+        if not self.icon_atlas.load():
+            self.icon_atlas.build_in_background()
             
-            if len(self.icon_cache) == 0:
-                print("No icons loaded. Make sure PNG files are named exactly like the Garmin icon names.")
-                print("Example: 'Scenic Area.png', 'Restaurant.png', 'Gas Station.png', etc.")
-                
-        except Exception as e:
-           print(f"Error loading Garmin icons: {e}")
+    def prewarm_icons(self):
+        """Decode the icons used most by the loaded waypoints before they are needed"""
+        usage = Counter(w.symbol for w in self.waypoint_store.all_waypoints())
+        keys = [self.symbols.key_for(symbol) for symbol, _ in usage.most_common(ICON_PREWARM_COUNT)]
+        self.icon_cache.prewarm(keys, MAP_ICON_SIZE)
                    
-    def load_waypoints(self):
-        """Load and display all GPX waypoints from the current directory"""
-        # Clear existing markers
-        for marker in self.map_markers:
-            marker.delete()
-        self.map_markers.clear()
-        
-        # Find all GPX files in current directory
-        gpx_files = glob.glob("*.gpx")
+    def load_waypoints(self, names=None):
+        """Bring the displayed GPX waypoints in line with the current directory.
+        Only files that were added, changed or removed since the last call are touched.
+        names limits the check to these files (reported by the folder watcher).
+        Parsing runs in the background; markers appear while the files come in."""
+        if names is not None and self.waypoint_loader.busy:
+            # Starting a load cancels the running one, so its files have to be compared as well
+            names = None
+        if self.index_cache is not None and not self.index_restored:
+            # First load: show what the index cache still holds, parse only the rest
+            self.index_restored = True
+            changed, removed = self.waypoint_store.restore(self.index_cache)
+            self.update_visible_markers()
+            if not changed:
+                self.root.after_idle(self.prewarm_icons)
+                self.write_waypoint_index()
+        else:
+            changed, removed = self.waypoint_store.diff(names)
+        for gpx_file in removed:
+            self.remove_waypoint_markers(self.waypoint_store.waypoints.get(gpx_file, []))
+            self.waypoint_store.remove_file(gpx_file)
+        
+        was_busy = self.waypoint_loader.busy
+        self.waypoint_loader.start(changed)
+        if changed and not was_busy:
+            self.reload_started = time.perf_counter()
+            self.root.after(20, self.poll_waypoint_loader)
+        
+    def poll_waypoint_loader(self):
+        """Take over parsed files from the loader and place their markers"""
+        for gpx_file, signature, waypoints, check in self.waypoint_loader.get_results():
+            if gpx_file in self.waypoint_store.pending:
+                # Saved in the meantime, the saved version wins
+                continue
+            if file_signature(gpx_file) != signature:
+                # Changed again while it was parsed, read it once more
+                self.reload_waypoint_file(gpx_file)
+                continue
+            self.remove_waypoint_markers(self.waypoint_store.waypoints.get(gpx_file, []))
+            self.waypoint_store.store_file(gpx_file, signature, waypoints, check)
+            self.add_waypoint_markers(waypoints)
+            
+        if self.waypoint_loader.busy:
+            if not self.move_mode:
+                self.info_label.config(text=f"Lade Waypoints ... noch {self.waypoint_loader.pending} Dateien")
+            self.root.after(20, self.poll_waypoint_loader)
+        else:
+            if not self.move_mode:
+                self.info_label.config(text="Klicken Sie auf die Karte, um einen Waypoint zu erstellen")
+            if instrumentation.enabled and self.reload_started is not None:
+                instrumentation.add("reload", self.reload_started, time.perf_counter() - self.reload_started)
+            self.reload_started = None
+            self.root.after_idle(self.prewarm_icons)
+            self.write_waypoint_index()
+
+    def write_waypoint_index(self):
+        """Keep the parsed waypoints for the next start"""
+        if self.index_cache is None or not self.waypoint_store.index_outdated:
+            return
+        try:
+            self.index_cache.write(self.waypoint_store)
+        except OSError as e:
+            print(f"Waypoint-Index konnte nicht geschrieben werden: {e}")
+
+    def reload_waypoint_file(self, gpx_file):
+        """Refresh a single file after it was saved, moved or deleted by this program"""
+        old_waypoints = self.waypoint_store.waypoints.get(gpx_file, [])
+        if self.waypoint_store.refresh_file(gpx_file):
+            self.remove_waypoint_markers(old_waypoints)
+            self.add_waypoint_markers(self.waypoint_store.waypoints.get(gpx_file, []))
+
+    @instrumentation.timed("save_waypoint")
+    def save_current_waypoint(self):
+        """Save the waypoint of the edit window. In a file with several waypoints (or a
+        collection) only its <wpt> is changed, otherwise the file is written whole."""
+        waypoint = self.form_waypoint()
+        gpx_file = self.current_waypoint
+        waypoints = list(self.waypoint_store.waypoints.get(gpx_file, []))
+        if len(waypoints) > 1 or self.is_collection(gpx_file):
+            # Replace the waypoint or append it (index == number of waypoints)
+            waypoints[waypoint.index:waypoint.index + 1] = [waypoint]
+            self.save_waypoint_file(gpx_file, waypoints, [("put", waypoint.index, waypoint)])
+        else:
+            self.save_waypoint_file(gpx_file, [waypoint])
+
+    def remove_current_waypoint(self):
+        """Remove the current waypoint from a file with several waypoints"""
+        gpx_file = self.current_waypoint
+        index = self.current_waypoint_index
+        waypoints = list(self.waypoint_store.waypoints.get(gpx_file, []))
+        del waypoints[index]
+        for i, waypoint in enumerate(waypoints):
+            waypoint.index = i
+        self.save_waypoint_file(gpx_file, waypoints, [("delete", index)])
+
+    def save_waypoint_file(self, gpx_file, waypoints, changes=None):
+        """Show the saved waypoints of a file at once and let the save queue write it.
+        With changes only those <wpt> are spliced into the file (see GpxCollection),
+        otherwise the file is written whole."""
+        old_waypoints = self.waypoint_store.waypoints.get(gpx_file, [])
+        if self.waypoint_store.database:
+            # Saved right away; the import signature is kept so the file is not imported over the change
+            self.waypoint_store.store_file(gpx_file, self.waypoint_store.signatures.get(gpx_file), waypoints)
+            self.remove_waypoint_markers(old_waypoints)
+            self.add_waypoint_markers(waypoints)
+            return
+        self.waypoint_store.store_file(gpx_file, None, waypoints)
+        self.waypoint_store.pending.add(gpx_file)
+        self.remove_waypoint_markers(old_waypoints)
+        self.add_waypoint_markers(waypoints)
         
-        for gpx_file in gpx_files:
+        if changes is None:
+            job = WriteFileJob(gpx_file, waypoints)
+        else:
+            job = CollectionJob(self.collection(gpx_file), changes, waypoints)
+        self.save_queue.save(gpx_file, job)
+        if not self.save_poll_scheduled:
+            self.save_poll_scheduled = True
+            self.root.after(100, self.poll_save_queue)
+
+    def poll_save_queue(self):
+        """Take over the results of finished writes"""
+        while True:
             try:
-                # Parse GPX file
-                tree = ET.parse(gpx_file)
-                root = tree.getroot()
+                gpx_file, signature, error = self.save_queue.results.get_nowait()
+            except queue.Empty:
+                break
+            if self.save_queue.busy(gpx_file):
+                # Saved again in the meantime, wait for that write
+                continue
+            self.waypoint_store.pending.discard(gpx_file)
+            if error is not None:
+                messagebox.showerror("Fehler", f"Fehler beim Speichern von {gpx_file}: {error}")
+                # Show what is really on disk
+                self.collections.pop(gpx_file, None)
+                self.reload_waypoint_file(gpx_file)
+            elif gpx_file in self.waypoint_store.waypoints:
+                # Remember the written state so the file is not parsed again
+                self.waypoint_store.signatures[gpx_file] = signature
                 
-                # Handle namespace
-                ns = {'gpx': 'http://www.topografix.com/GPX/1/1'}
-                
-                # Find waypoints
-                for wpt in root.findall('.//gpx:wpt', ns):
-                    lat = float(wpt.get('lat'))
-                    lon = float(wpt.get('lon'))
-                    
-                    # Get waypoint name
-                    name_elem = wpt.find('gpx:name', ns)
-                    name = name_elem.text if name_elem is not None else "Unbenannt"
-                    
-                    # Get symbol/icon
-                    sym_elem = wpt.find('gpx:sym', ns)
-                    symbol = sym_elem.text if sym_elem is not None else "Waypoint"
-                    
-                    # Get icon for marker
-                    icon_image = None
-                    # Find the key for the symbol value
-                    icon_key = None
-                    for key, value in self.garmin_icons.items():
-                        if value == symbol:
-                            icon_key = key
-                            break
-                    
-                    if icon_key and icon_key in self.icon_cache:
-                        icon_image = self.icon_cache[icon_key]['map']
-                    
-                    # Create marker
-                    if icon_image:
-                        marker = self.map_widget.set_marker(
-                            lat, lon, 
-                            text=name,
-                            text_color="black",
-                            font=("Arial", 8),
-                            icon=icon_image,
-                            command=lambda coord, file=gpx_file, wpt_name=name: self.on_waypoint_click(coord, file, wpt_name)
-                        )
-                    else:
-                        marker = self.map_widget.set_marker(
-                            lat, lon, 
-                            text=name,
-                            text_color="black",
-                            font=("Arial", 8),
-                            command=lambda coord, file=gpx_file, wpt_name=name: self.on_waypoint_click(coord, file, wpt_name)
-                        )
-                    self.map_markers.append(marker)
-                    
-            except Exception as e:
-                print(f"Fehler beim Laden von {gpx_file}: {e}")
-                
-    def on_waypoint_click(self, coordinates, filename, waypoint_name):
-        """Handle click on existing waypoint marker"""
-        # Load the waypoint data for editing
-        try:
-            tree = ET.parse(filename)
-            root = tree.getroot()
-            ns = {'gpx': 'http://www.topografix.com/GPX/1/1'}
+        if self.save_queue.pending or self.save_queue.writing or not self.save_queue.results.empty():
+            self.root.after(100, self.poll_save_queue)
+        else:
+            self.save_poll_scheduled = False
+
+    def is_collection(self, gpx_file):
+        if not COLLECTION_NAME:
+            return False
+        return re.fullmatch(re.escape(COLLECTION_NAME) + r"(_\d+)?\.gpx", os.path.basename(gpx_file)) is not None
+
+    def collection(self, gpx_file):
+        if gpx_file not in self.collections:
+            self.collections[gpx_file] = GpxCollection(gpx_file)
+        return self.collections[gpx_file]
+
+    def collection_shard_for_new(self):
+        """Collection file that takes the next new waypoint"""
+        shard = 1
+        while True:
+            gpx_file = f"{COLLECTION_NAME}.gpx" if shard == 1 else f"{COLLECTION_NAME}_{shard}.gpx"
+            if len(self.waypoint_store.waypoints.get(gpx_file, [])) < COLLECTION_SHARD_SIZE:
+                return gpx_file
+            shard += 1
+
+    def get_view_bounds(self):
+        """(south, west, north, east) of the visible map area plus a margin of half a screen"""
+        zoom = round(self.map_widget.zoom)
+        left, top = self.map_widget.upper_left_tile_pos
+        right, bottom = self.map_widget.lower_right_tile_pos
+        margin_x = (right - left) / 2
+        margin_y = (bottom - top) / 2
+        n = 1 << zoom
+        north, west = world_to_latlon((left - margin_x) / n, (top - margin_y) / n)
+        south, east = world_to_latlon((right + margin_x) / n, (bottom + margin_y) / n)
+        return (max(south, -90.0), max(west, -180.0), min(north, 90.0), min(east, 180.0))
+
+    def watch_viewport(self):
+        """Create and destroy markers as the map is panned or zoomed"""
+        view = (self.map_widget.zoom, self.map_widget.upper_left_tile_pos, self.map_widget.lower_right_tile_pos)
+        if view != self.last_view:
+            self.last_view = view
+            self.update_visible_markers()
+        self.root.after(150, self.watch_viewport)
+
+    @instrumentation.timed("update_markers")
+    def update_visible_markers(self):
+        """Only waypoints inside the viewport (plus margin) get a marker.
+        At clustered zoom levels a cell with several waypoints gets one count marker."""
+        self.cluster_update_pending = False
+        self.visible_bounds = self.get_view_bounds()
+        zoom = round(self.map_widget.zoom)
+        
+        clusters = {}
+        if self.waypoint_store.clusters.clustered(zoom):
+            visible = set()
+            for cell, count, lat, lon in self.waypoint_store.clusters.query(zoom, self.visible_bounds):
+                if count == 1:
+                    visible.update(self.waypoints_in_cell(zoom, cell))
+                else:
+                    clusters[(zoom, cell)] = (count, lat, lon)
+        else:
+            visible = set(self.waypoint_store.waypoints_in(self.visible_bounds))
             
-            # Find the specific waypoint by name
-            for wpt in root.findall('.//gpx:wpt', ns):
-                name_elem = wpt.find('gpx:name', ns)
-                if name_elem is not None and name_elem.text == waypoint_name:
-                    # Set current waypoint data
-                    self.waypoint_lat = float(wpt.get('lat'))
-                    self.waypoint_lon = float(wpt.get('lon'))
-                    self.current_waypoint = filename
-                    self.waypoint_saved = True
-                    
-                    # Open edit window with existing data
-                    self.open_edit_window(wpt, ns)
-                    break
-                    
-        except Exception as e:
-            messagebox.showerror("Fehler", f"Fehler beim Laden des Waypoints: {e}")
+        self.delete_markers([w for w in self.map_markers if w not in visible])
+        self.add_waypoint_markers(visible, force=True)
+        self.update_cluster_markers(clusters)
+
+    def waypoints_in_cell(self, zoom, cell):
+        clusters = self.waypoint_store.clusters
+        south, west, north, east = clusters.cell_bounds(zoom, cell)
+        shift = clusters.max_zoom - 1 - zoom
+        for waypoint in self.waypoint_store.waypoints_in((south - 1e-9, west - 1e-9, north + 1e-9, east + 1e-9)):
+            cx, cy = clusters.finest_cell(waypoint)
+            if (cx >> shift, cy >> shift) == cell:
+                yield waypoint
+
+    def update_cluster_markers(self, clusters):
+        """Bring the count markers in line with clusters ((zoom, cell) -> (count, lat, lon))"""
+        for key in [k for k in self.cluster_markers if k not in clusters]:
+            self.cluster_markers.pop(key)[1].delete()
+        for key, (count, lat, lon) in clusters.items():
+            existing = self.cluster_markers.get(key)
+            if existing is not None:
+                if existing[0] != count:
+                    existing[0] = count
+                    existing[1].set_text(str(count))
+                    existing[1].set_position(lat, lon)
+                continue
+            marker = self.map_widget.set_marker(
+                lat, lon,
+                text=str(count),
+                text_color="black",
+                font=("Arial", 9, "bold"),
+                marker_color_circle="white",
+                marker_color_outside="#1f6aa5",
+                command=self.on_cluster_click
+            )
+            self.cluster_markers[key] = [count, marker]
+
+    def on_cluster_click(self, marker):
+        """Zoom into a cluster"""
+        lat, lon = marker.position
+        self.map_widget.set_position(lat, lon)
+        self.map_widget.set_zoom(round(self.map_widget.zoom) + 2)
+
+    def schedule_cluster_update(self):
+        """Recount the visible clusters once after a batch of store changes"""
+        if not self.cluster_update_pending:
+            self.cluster_update_pending = True
+            self.root.after_idle(self.update_visible_markers)
+
+    def in_view(self, waypoint):
+        if self.visible_bounds is None:
+            self.visible_bounds = self.get_view_bounds()
+        south, west, north, east = self.visible_bounds
+        return south <= waypoint.lat <= north and west <= waypoint.lon <= east
+
+    def remove_waypoint_markers(self, waypoints):
+        """Remove the markers of waypoints that left the store"""
+        self.delete_markers(waypoints)
+        if self.waypoint_store.clusters.clustered(round(self.map_widget.zoom)):
+            self.schedule_cluster_update()
+
+    def delete_markers(self, waypoints):
+        for waypoint in waypoints:
+            marker = self.map_markers.pop(waypoint, None)
+            if marker is not None:
+                marker.delete()
+
+    def add_waypoint_markers(self, waypoints, force=False):
+        """Create markers for those waypoints that lie in the visible map area.
+        At clustered zoom levels the clusters are recounted instead."""
+        if not force and self.waypoint_store.clusters.clustered(round(self.map_widget.zoom)):
+            self.schedule_cluster_update()
+            return
+        for waypoint in waypoints:
+            if waypoint not in self.map_markers and self.in_view(waypoint):
+                self.map_markers[waypoint] = self.create_waypoint_marker(waypoint)
+
+    @instrumentation.timed("set_marker")
+    def create_waypoint_marker(self, waypoint):
+        name = waypoint.name
+        symbol = waypoint.symbol
+
+        # Get icon for marker
+        icon_image = None
+        icon_key = self.symbols.key_for(symbol)
+        if icon_key:
+            icon_image = self.icon_cache.get(icon_key, MAP_ICON_SIZE)
+
+        # Create marker
+        if icon_image:
+            return self.map_widget.set_marker(
+                waypoint.lat, waypoint.lon,
+                text=name,
+                text_color="black",
+                font=("Arial", 8),
+                icon=icon_image,
+                command=lambda marker, waypoint=waypoint: self.on_waypoint_click(waypoint.id)
+            )
+        return self.map_widget.set_marker(
+            waypoint.lat, waypoint.lon,
+            text=name,
+            text_color="black",
+            font=("Arial", 8),
+            command=lambda marker, waypoint=waypoint: self.on_waypoint_click(waypoint.id)
+        )
+
+    def on_waypoint_click(self, waypoint_id):
+        """Handle click on existing waypoint marker. The data comes from the waypoint store."""
+        waypoint = self.waypoint_store.get(waypoint_id)
+        if waypoint is None:
+            messagebox.showerror("Fehler", "Der Waypoint ist nicht mehr vorhanden.")
+            return
+            
+        # Set current waypoint data
+        self.waypoint_lat = waypoint.lat
+        self.waypoint_lon = waypoint.lon
+        self.current_waypoint = waypoint.filename
+        self.current_waypoint_index = waypoint.index
+        self.waypoint_saved = True
+        
+        # Open edit window with existing data
+        self.open_edit_window(waypoint)
             
     def on_map_click(self, coordinates_tuple):
         # Check if we're in move mode
@@ -344,6 +1334,7 @@ class GarminWaypointCreator:
         self.waypoint_lat = coordinates_tuple[0]
         self.waypoint_lon = coordinates_tuple[1]
         self.current_waypoint = None  # New waypoint
+        self.current_waypoint_index = None
         self.waypoint_saved = False
         
         # Open edit window
@@ -380,7 +1371,8 @@ class GarminWaypointCreator:
             self.edit_window.grab_set()  # Restore grab
             
         # Refresh waypoints to show new position
-        self.load_waypoints()
+        if self.current_waypoint:
+            self.reload_waypoint_file(self.current_waypoint)
         
     def start_move_mode(self):
         """Start move mode for waypoint"""
@@ -389,9 +1381,7 @@ class GarminWaypointCreator:
         
         # Add temporary marker at current position to show what's being moved
         icon_name = self.icon_var.get()
-        icon_image = None
-        if icon_name in self.icon_cache:
-            icon_image = self.icon_cache[icon_name]['map']
+        icon_image = self.icon_cache.get(icon_name, MAP_ICON_SIZE)
         
         if icon_image:
             self.temp_move_marker = self.map_widget.set_marker(
@@ -416,7 +1406,7 @@ class GarminWaypointCreator:
         # Release grab so map clicks can be processed
         self.edit_window.grab_release()
         
-    def open_edit_window(self, existing_wpt=None, ns=None):
+    def open_edit_window(self, existing_wpt=None):
         if self.edit_window:
             self.edit_window.destroy()
             
@@ -463,7 +1453,7 @@ class GarminWaypointCreator:
         
         # Icon combobox
         self.icon_var = tk.StringVar(value="Scenic Area")  # Default icon
-        icon_combo = ttk.Combobox(icon_select_frame, textvariable=self.icon_var, values=list(self.garmin_icons.keys()), 
+        icon_combo = ttk.Combobox(icon_select_frame, textvariable=self.icon_var, values=self.symbols.names(), 
                                   state="readonly", font=("Arial", 10))
         icon_combo.pack(side=tk.LEFT, fill=tk.X, expand=True)
         icon_combo.bind('<<ComboboxSelected>>', self.on_icon_change)
@@ -504,8 +1494,8 @@ class GarminWaypointCreator:
             link_var.trace('w', self.on_field_change)
         
         # Load existing waypoint data if editing
-        if existing_wpt is not None and ns is not None:
-            self.load_waypoint_data(existing_wpt, ns)
+        if existing_wpt is not None:
+            self.load_waypoint_data(existing_wpt)
             
         # Update icon display after loading data
         self.root.after(100, self.update_icon_display)
@@ -557,65 +1547,81 @@ class GarminWaypointCreator:
     def update_icon_display(self):
         """Update the icon display next to the combobox"""
         icon_name = self.icon_var.get()
-        if icon_name in self.icon_cache and 'large' in self.icon_cache[icon_name]:
-            self.icon_display_label.config(image=self.icon_cache[icon_name]['large'])
+        icon_image = self.icon_cache.get(icon_name, LARGE_ICON_SIZE)
+        if icon_image:
+            self.icon_display_label.config(image=icon_image)
             # Keep a reference to prevent garbage collection
-            self.icon_display_label.image = self.icon_cache[icon_name]['large']
+            self.icon_display_label.image = icon_image
         else:
             self.icon_display_label.config(image="", text=icon_name[:10] + "..." if len(icon_name) > 10 else icon_name)
         
-    def load_waypoint_data(self, wpt, ns):
+    def load_waypoint_data(self, waypoint):
         """Load data from existing waypoint into the edit form"""
         # Load name
-        name_elem = wpt.find('gpx:name', ns)
-        if name_elem is not None:
-            self.name_var.set(name_elem.text)
+        self.name_var.set(waypoint.name or "")
         
         # Load description
-        desc_elem = wpt.find('gpx:desc', ns)
-        if desc_elem is not None:
+        if waypoint.desc:
             # Extract plain text from HTML description
-            desc_text = desc_elem.text or ""
-            # Simple HTML to text conversion
-            import re
-            # Remove HTML tags but keep content
-            desc_text = re.sub(r'<h2>.*?</h2>', '', desc_text)
-            desc_text = re.sub(r'<p><a.*?>(.*?)</a></p>', '', desc_text)  # Remove links from description
-            desc_text = desc_text.strip()
-            self.desc_text.insert("1.0", desc_text)
+            self.desc_text.insert("1.0", description_text(waypoint.desc))
         
         # Load symbol/icon
-        sym_elem = wpt.find('gpx:sym', ns)
-        if sym_elem is not None:
-            symbol = sym_elem.text
-            # Find matching icon key
-            for key, value in self.garmin_icons.items():
-                if value == symbol:
-                    self.icon_var.set(key)
-                    break
+        icon_key = self.symbols.key_for(waypoint.symbol)
+        if icon_key:
+            self.icon_var.set(icon_key)
         
         # Load links
-        link_elements = wpt.findall('gpx:link', ns)
-        for i, link_elem in enumerate(link_elements[:3]):  # Max 3 links
-            href = link_elem.get('href')
-            if href and i < len(self.link_vars):
+        for i, href in enumerate(waypoint.links[:3]):  # Max 3 links
+            if i < len(self.link_vars):
                 self.link_vars[i].set(href)
         
     def delete_waypoint(self):
-        """Delete the current waypoint file"""
-        if self.current_waypoint and os.path.exists(self.current_waypoint):
+        """Delete the current waypoint file, or only the waypoint if the file holds several"""
+        if (self.current_waypoint_index is not None
+                and len(self.waypoint_store.waypoints.get(self.current_waypoint, [])) > 1):
+            waypoint = self.waypoint_store.get((self.current_waypoint, self.current_waypoint_index))
+            if messagebox.askyesno("Löschen bestätigen",
+                                   f"Möchten Sie den Waypoint '{waypoint.name}' aus '{self.current_waypoint}' wirklich löschen?"):
+                self.remove_current_waypoint()
+                self.edit_window.destroy()
+                self.edit_window = None
+            return
+        
+        if self.waypoint_store.database:
+            if self.current_waypoint in self.waypoint_store.waypoints and messagebox.askyesno(
+                    "Löschen bestätigen", f"Möchten Sie den Waypoint '{self.current_waypoint}' wirklich löschen?"):
+                self.delete_waypoint_file(self.current_waypoint)
+                self.edit_window.destroy()
+                self.edit_window = None
+            return
+        
+        if self.current_waypoint and (os.path.exists(self.current_waypoint)
+                                      or self.current_waypoint in self.waypoint_store.pending):
             result = messagebox.askyesno("Löschen bestätigen", 
                                        f"Möchten Sie den Waypoint '{self.current_waypoint}' wirklich löschen?")
             if result:
                 try:
-                    os.remove(self.current_waypoint)
+                    self.delete_waypoint_file(self.current_waypoint)
                     messagebox.showinfo("Gelöscht", f"Waypoint {self.current_waypoint} wurde gelöscht.")
                     self.edit_window.destroy()
                     self.edit_window = None
-                    # Refresh waypoints display
-                    self.load_waypoints()
                 except Exception as e:
                     messagebox.showerror("Fehler", f"Fehler beim Löschen: {e}")
+
+    def delete_waypoint_file(self, gpx_file):
+        """Delete a waypoint file and its markers"""
+        if self.waypoint_store.database:
+            # Only the database records go, an imported GPX file stays as it is
+            self.remove_waypoint_markers(self.waypoint_store.waypoints.get(gpx_file, []))
+            self.waypoint_store.remove_file(gpx_file)
+            return
+        # A save that is not yet written must not bring the file back
+        self.save_queue.discard(gpx_file)
+        self.waypoint_store.pending.discard(gpx_file)
+        self.collections.pop(gpx_file, None)
+        if os.path.exists(gpx_file):
+            os.remove(gpx_file)
+        self.reload_waypoint_file(gpx_file)
     
     def on_name_change(self, *args):
         self.update_save_button_state()
@@ -644,17 +1650,19 @@ class GarminWaypointCreator:
             messagebox.showerror("Fehler", "Name ist erforderlich!")
             return
             
-        # Generate random filename if new waypoint
+        # New waypoint: append it to the collection or generate a random filename
         if not self.current_waypoint:
-            self.current_waypoint = ''.join(random.choices(string.ascii_letters + string.digits, k=8)) + '.gpx'
-        
-        # Create GPX content
-        gpx_content = self.create_gpx_content()
+            if COLLECTION_NAME:
+                self.current_waypoint = self.collection_shard_for_new()
+                self.current_waypoint_index = len(self.waypoint_store.waypoints.get(self.current_waypoint, []))
+            else:
+                self.current_waypoint = random_filename()
+                self.current_waypoint_index = 0
         
-        # Save file
+        # Save file (written in the background) and refresh the waypoints display
+        # without changing map position/zoom
         try:
-            with open(self.current_waypoint, 'w', encoding='utf-8') as f:
-                f.write(gpx_content)
+            self.save_current_waypoint()
             
             # Create custom success popup that auto-closes
             self.show_auto_close_message("Erfolg", f"Waypoint gespeichert als: {self.current_waypoint}")
@@ -663,9 +1671,6 @@ class GarminWaypointCreator:
             self.new_button.config(state=tk.NORMAL)
             self.waypoint_saved = True
             
-            # Refresh waypoints display without changing map position/zoom
-            self.load_waypoints()
-            
         except Exception as e:
             messagebox.showerror("Fehler", f"Fehler beim Speichern: {str(e)}")
     
@@ -690,85 +1695,24 @@ class GarminWaypointCreator:
     def auto_save_waypoint(self):
         """Automatically save waypoint without user notification"""
         try:
-            # Create GPX content
-            gpx_content = self.create_gpx_content()
-            
-            # Save file silently
-            with open(self.current_waypoint, 'w', encoding='utf-8') as f:
-                f.write(gpx_content)
+            # Save file silently (written in the background)
+            self.save_current_waypoint()
                 
         except Exception as e:
             print(f"Auto-save failed: {e}")  # Silent error logging
             
-    def create_gpx_content(self):
-        # Create GPX XML structure
-        gpx = ET.Element('gpx', {
-            'version': '1.1',
-            'creator': 'Garmin Waypoint Creator',
-            'xmlns': 'http://www.topografix.com/GPX/1/1',
-            'xmlns:xsi': 'http://www.w3.org/2001/XMLSchema-instance',
-            'xmlns:gpxx': 'http://www.garmin.com/xmlschemas/GpxExtensions/v3',
-            'xmlns:ctx': 'http://www.garmin.com/xmlschemas/CreationTimeExtension/v1',
-            'xsi:schemaLocation': 'http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/1/1/gpx.xsd http://www.garmin.com/xmlschemas/GpxExtensions/v3 http://www.garmin.com/xmlschemas/GpxExtensionsv3.xsd http://www.garmin.com/xmlschemas/CreationTimeExtension/v1 http://www.garmin.com/xmlschemas/CreationTimeExtensionv1.xsd'
-        })
-        
-        # Add waypoint
-        wpt = ET.SubElement(gpx, 'wpt', {
-            'lat': str(self.waypoint_lat),
-            'lon': str(self.waypoint_lon)
-        })
-        
-        # Add name
-        name_elem = ET.SubElement(wpt, 'name')
-        name_elem.text = self.name_var.get().strip()
-        
-        # Create description with HTML
-        desc_content = f"<h2>{self.name_var.get().strip()}</h2>\n"
-        
-        # Add description text
-        desc_text = self.desc_text.get("1.0", tk.END).strip()
-        if desc_text:
-            desc_content += desc_text + "\n"
-        
-        # Add hyperlinks as HTML
-        for link_var in self.link_vars:
-            link = link_var.get().strip()
-            if link:
-                desc_content += f'<p><a href="{link}" target="_blank">{link}</a></p>\n'
-        
-        desc_elem = ET.SubElement(wpt, 'desc')
-        desc_elem.text = desc_content
-        
-        # Add links as GPX standard elements (first)
-        for link_var in self.link_vars:
-            link = link_var.get().strip()
-            if link:
-                link_elem = ET.SubElement(wpt, 'link')
-                link_elem.set('href', link)
-        
-        # Add symbol (icon) after links
-        sym_elem = ET.SubElement(wpt, 'sym')
-        sym_elem.text = self.garmin_icons[self.icon_var.get()]
-        
-        # Add Garmin extensions
-        extensions = ET.SubElement(wpt, 'extensions')
-        gpxx_elem = ET.SubElement(extensions, 'gpxx:WaypointExtension')
-        
-        # Add display mode (only SymbolAndName needed)
-        display_mode = ET.SubElement(gpxx_elem, 'gpxx:DisplayMode')
-        display_mode.text = 'SymbolAndName'
-        
-        # Add time at the end of extensions
-        ctx_elem = ET.SubElement(extensions, 'ctx:CreationTimeExtension')
-        ctx_elem.set('xmlns:ctx', 'http://www.garmin.com/xmlschemas/CreationTimeExtension/v1')
-        ctx_time = ET.SubElement(ctx_elem, 'ctx:CreationTime')
-        ctx_time.text = datetime.utcnow().isoformat() + 'Z'
-        
-        # Convert to pretty XML string
-        rough_string = ET.tostring(gpx, encoding='unicode')
-        reparsed = xml.dom.minidom.parseString(rough_string)
-        return reparsed.toprettyxml(indent="  ")
-        
+    def form_waypoint(self):
+        """Waypoint record with the data of the edit window"""
+        name = self.name_var.get().strip()
+        links = [link_var.get().strip() for link_var in self.link_vars if link_var.get().strip()]
+        desc = build_description(name, self.desc_text.get("1.0", tk.END).strip(), links)
+        # An edited waypoint keeps its creation time (the duplicate finder keeps the oldest)
+        index = self.current_waypoint_index or 0
+        existing = self.waypoint_store.waypoints.get(self.current_waypoint, [])
+        created = existing[index].time if index < len(existing) and existing[index].time else creation_time_now()
+        return Waypoint(self.current_waypoint, index, self.waypoint_lat, self.waypoint_lon, name,
+                        self.symbols.symbol_for(self.icon_var.get()), desc, tuple(links), created)
+
     def new_waypoint(self):
         self.edit_window.destroy()
         self.edit_window = None
@@ -786,6 +1730,20 @@ class GarminWaypointCreator:
         self.edit_window = None
         
     def close_program(self):
+        # Write everything that is still waiting in the save queue
+        self.save_queue.close()
+        self.waypoint_loader.shutdown()
+        self.write_waypoint_index()
+        if self.folder_watcher is not None:
+            self.folder_watcher.stop()
+        if self.prefetcher is not None:
+            self.prefetcher.cancel()
+        self.map_widget.running = False
+        self.tile_store.close()
+        if self.waypoint_store.database:
+            self.waypoint_store.close()
+        if instrumentation.enabled:
+            write_profile()
         self.root.quit()
         self.root.destroy()
         
@@ -793,7 +1751,44 @@ class GarminWaypointCreator:
         self.root.protocol("WM_DELETE_WINDOW", self.close_program)
         self.root.mainloop()
 
+def build_icon_atlas():
+    """Build step for the PyInstaller bundle: write the icon atlas next to the program"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    symbols = SymbolRegistry(os.path.join(base_dir, "icons_garmin"), {})
+    IconAtlas(symbols, (MAP_ICON_SIZE, LARGE_ICON_SIZE), [base_dir]).build()
+    print(f"Icon atlas with {len(symbols.icon_paths)} icons written to {base_dir}")
+
+profiler = None
+
+def start_profile():
+    """Switch on the instrumentation (and cProfile) as set by PROFILE"""
+    global profiler
+    instrumentation.enable()
+    if PROFILE == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+def write_profile():
+    """Write the trace (and the cProfile statistics) into the cache folder"""
+    directory = user_cache_dir()
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    trace_file = os.path.join(directory, f"profile_{stamp}.json")
+    instrumentation.dump_json(trace_file)
+    print(f"Zeitmessung gespeichert: {trace_file}")
+    if profiler is not None:
+        profiler.disable()
+        profile_file = os.path.join(directory, f"profile_{stamp}.prof")
+        profiler.dump_stats(profile_file)
+        print(f"cProfile gespeichert: {profile_file}")
+
 if __name__ == "__main__":
+    if "--build-icon-atlas" in sys.argv:
+        build_icon_atlas()
+        sys.exit(0)
+    if PROFILE:
+        start_profile()
     try:
         app = GarminWaypointCreator()
         app.run()
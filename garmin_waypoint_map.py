@@ -0,0 +1,185 @@
+# ##########################################################################################
+# garmin_waypoint_map
+# Hans Straßgütl
+#
+# The map widget of garmin_waypoint_creator with its tile cache and the tile download for
+# offline use. Kept apart from the program because tkintermapview, requests and PIL take
+# most of the start time; the program imports this module once its window is shown.
+# ..........................................................................................
+# More information: readme.md
+#
+# Changes:
+#   2026 10 17      Split off from garmin_waypoint_creator.
+#
+# ##########################################################################################
+# Version 1.5
+# ------------------------------------------------------------------------------------------
+# Global Imports
+# ------------------------------------------------------------------------------------------
+
+import tkintermapview
+import requests
+from PIL import Image, ImageTk
+from io import BytesIO
+import threading
+import time
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from garmin_waypoint_core import instrumentation
+
+# ------------------------------------------------------------------------------------------
+# Map tiles
+# ------------------------------------------------------------------------------------------
+
+def tile_url(server, zoom, x, y):
+    return server.replace("{x}", str(x)).replace("{y}", str(y)).replace("{z}", str(zoom))
+
+# fetch_tile result for a tile the server does not have (404)
+NO_TILE = object()
+
+def decode_tile(data):
+    """PIL image of tile data, or None if it is not an image (error or captive portal page, cut-off download)"""
+    try:
+        image = Image.open(BytesIO(data))
+        image.load()
+    except Exception:
+        return None
+    return image
+
+class TilePrefetcher:
+    """Downloads a set of tiles into the TileStore ahead of a trip.
+
+    Runs on its own thread with a small pool of workers sharing one pooled HTTP
+    session. Requests are spaced to at most `rate` per second; the public OSM
+    servers do not allow heavy bulk downloads, so keep the areas small or use
+    your own tile server (GWC_TILE_SERVER). Tiles already in the store are
+    skipped, which makes an interrupted prefetch resume where it stopped.
+    Progress is read from total/done/skipped/failed.
+    """
+    def __init__(self, tile_store, tile_server, workers=4, rate=4.0):
+        self.tile_store = tile_store
+        self.tile_server = tile_server
+        self.workers = workers
+        self.interval = 1.0 / rate if rate else 0.0
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.next_request = 0.0
+        self.total = self.done = self.skipped = self.failed = 0
+        self.running = False
+        
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = CachedMapView.USER_AGENT
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def start(self, tiles):
+        self.total = len(tiles)
+        self.running = True
+        threading.Thread(target=self.run, args=(list(tiles),), name="tile-prefetch", daemon=True).start()
+
+    def run(self, tiles):
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tile-prefetch") as executor:
+                for _ in executor.map(self.fetch, tiles):
+                    pass
+        finally:
+            self.session.close()
+            self.running = False
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def wait_turn(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_request - now
+            self.next_request = max(now, self.next_request) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def fetch(self, tile):
+        if self.cancelled.is_set():
+            return
+        zoom, x, y = tile
+        try:
+            if self.tile_store.contains(self.tile_server, zoom, x, y):
+                self.count("skipped")
+                return
+            self.wait_turn()
+            response = self.session.get(tile_url(self.tile_server, zoom, x, y), timeout=15)
+            # Only images are stored, anything else would count as "skipped" on the next run
+            if response.status_code == 200 and decode_tile(response.content) is not None:
+                self.tile_store.put(self.tile_server, zoom, x, y, response.content)
+            else:
+                self.count("failed")
+        except (requests.exceptions.RequestException, sqlite3.Error):
+            self.count("failed")
+        finally:
+            self.count("done")
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+class CachedMapView(tkintermapview.TkinterMapView):
+    """TkinterMapView that takes its tiles from a TileStore and can work without network"""
+    USER_AGENT = "GarminWaypointCreator/1.5 (+https://gravelmaps.de)"
+
+    def __init__(self, *args, tile_store=None, offline=False, **kwargs):
+        # Set before the base class starts its tile loader threads
+        self.tile_store = tile_store
+        self.offline = offline
+        self.http = threading.local()
+        super().__init__(*args, **kwargs)
+
+    def session(self):
+        """One pooled HTTP session per tile loader thread"""
+        session = getattr(self.http, "session", None)
+        if session is None:
+            session = self.http.session = requests.Session()
+            session.headers["User-Agent"] = self.USER_AGENT
+        return session
+
+    def fetch_tile(self, zoom, x, y):
+        """Tile image from the store or, if online, from the tile server. NO_TILE if the server
+        has no such tile (404), None if it is unavailable for now (offline, server error, rate
+        limit, a body that is not an image). Only tiles that decode are stored."""
+        if self.tile_store is not None:
+            data = self.tile_store.get(self.tile_server, zoom, x, y)
+            if data is not None:
+                image = decode_tile(data)
+                if image is not None:
+                    return image
+                # A damaged row (e.g. an error page stored by an earlier version): download again
+                self.tile_store.delete(self.tile_server, zoom, x, y)
+        if self.offline:
+            return None
+        with instrumentation.timer("tile_download"):
+            response = self.session().get(tile_url(self.tile_server, zoom, x, y), timeout=10)
+        if response.status_code == 404:
+            return NO_TILE
+        if response.status_code != 200:
+            return None
+        image = decode_tile(response.content)
+        if image is not None and self.tile_store is not None:
+            self.tile_store.put(self.tile_server, zoom, x, y, response.content)
+        return image
+
+    def request_image(self, zoom, x, y, db_cursor=None):
+        try:
+            image = self.fetch_tile(zoom, x, y)
+        except (requests.exceptions.RequestException, sqlite3.Error):
+            return self.empty_tile_image
+        if image is None:
+            # Not available for now: not remembered, so it is requested again later
+            return self.empty_tile_image
+        if image is NO_TILE:
+            # The server has no tile for these coordinates
+            self.tile_image_cache[f"{zoom}{x}{y}"] = self.empty_tile_image
+            return self.empty_tile_image
+        if not self.running:
+            return self.empty_tile_image
+        image_tk = ImageTk.PhotoImage(image)
+        self.tile_image_cache[f"{zoom}{x}{y}"] = image_tk
+        return image_tk
@@ -0,0 +1,13 @@
+"""Importing the program has to stay within the import time budget (see garmin_waypoint_benchmark)"""
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import garmin_waypoint_benchmark as benchmark
+
+
+def test_import_budget():
+    out = io.StringIO()
+    assert benchmark.check_import_budget(3, out=out), out.getvalue()